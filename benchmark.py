@@ -0,0 +1,412 @@
+"""Offline benchmark and load test for the bot's hot paths.
+
+Drives the bot's handlers with stand-in Discord objects and a fake REST layer, so no
+token or gateway connection is needed. Synthetic guilds are filled with users and
+points, state is written to a throwaway directory, and every flow reports throughput,
+p50/p99 latency, REST calls per operation and peak memory (from a separate
+tracemalloc pass, so tracing doesn't skew the timings). Run it before deploying to
+catch regressions:
+
+    python benchmark.py --guilds 10 --users 1000 --ops 5000
+    python benchmark.py --concurrency 50 --http-latency-ms 40    # closer to a live bot under load
+    python benchmark.py --image-kb 2048 --duplicates 0.3          # heavier vouch images, more reposts
+"""
+import argparse
+import asyncio
+import datetime
+import functools
+import itertools
+import logging
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from types import SimpleNamespace
+
+import bot_MERGED as vouchbot
+
+REWARD_NAME = 'Bench Reward'
+
+# ======= FAKE REST LAYER =======
+class FakeHTTP:
+    """Stands in for Discord's REST API - every call is counted and takes a fixed latency"""
+    
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+    
+    async def request(self, route):
+        self.calls[route] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+http = FakeHTTP()
+message_ids = itertools.count(10 ** 9)
+
+class FakeDownload:
+    """Response of the fake CDN - the image is an 8-byte seed followed by a shared filler block"""
+    
+    def __init__(self, seed, size):
+        self.seed = seed
+        self.size = size
+        self.content = self
+    
+    async def __aenter__(self):
+        await http.request('GET cdn/attachments')
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        return False
+    
+    def raise_for_status(self):
+        pass
+    
+    async def iter_chunked(self, chunk_size):
+        yield self.seed.to_bytes(8, 'big')
+        remaining = self.size - 8
+        filler = bytes(chunk_size)
+        while remaining > 0:
+            yield filler[:remaining]
+            remaining -= chunk_size
+
+class FakeSession:
+    """Stands in for the bot's aiohttp session when it downloads vouch images"""
+    closed = False
+    
+    def get(self, url):
+        seed, size = url.rsplit('/', 2)[-2:]
+        return FakeDownload(int(seed), int(size))
+
+session = FakeSession()
+
+# ======= STAND-IN DISCORD OBJECTS =======
+class FakeUser:
+    def __init__(self, user_id, name, bot=False, administrator=False):
+        self.id = user_id
+        self.name = name
+        self.display_name = name
+        self.mention = f"<@{user_id}>"
+        self.bot = bot
+        self.guild_permissions = SimpleNamespace(administrator=administrator)
+    
+    async def send(self, *args, **kwargs):
+        await http.request('POST /users/@me/channels')  # Opening the DM channel
+        await http.request('POST /channels/{id}/messages')
+
+class FakeChannel:
+    def __init__(self, channel_id, name, guild):
+        self.id = channel_id
+        self.name = name
+        self.guild = guild
+        self.mention = f"<#{channel_id}>"
+        self.position = channel_id
+        self.sent = 0
+    
+    async def send(self, *args, **kwargs):
+        self.sent += 1
+        await http.request('POST /channels/{id}/messages')
+        return FakeMessage(next(message_ids), None, self, '')
+    
+    async def fetch_message(self, message_id):
+        await http.request('GET /channels/{id}/messages/{id}')
+        return FakeMessage(message_id, None, self, '')
+
+class FakeGuild:
+    def __init__(self, guild_id, name, channel_names):
+        self.id = guild_id
+        self.name = name
+        self.channels = [FakeChannel(guild_id * 1000 + i, channel_name, self) for i, channel_name in enumerate(channel_names)]
+        self.text_channels = list(self.channels)
+        self.members = {}
+    
+    def get_channel(self, channel_id):
+        return next((channel for channel in self.channels if channel.id == channel_id), None)
+    
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+class FakeMessage:
+    def __init__(self, message_id, author, channel, content, attachments=()):
+        self.id = message_id
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.content = content
+        self.attachments = list(attachments)
+        self.jump_url = f"https://discord.com/channels/{self.guild.id}/{channel.id}/{message_id}"
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+    
+    async def add_reaction(self, emoji):
+        await http.request('PUT /channels/{id}/messages/{id}/reactions')
+
+class FakeAttachment:
+    def __init__(self, seed, size):
+        self.url = f"https://cdn.example/attachments/{seed}/{size}"
+        self.filename = f"vouch-{seed}.png"
+        self.size = size
+        self.width = 1080
+        self.height = 1920
+
+class FakeResponse:
+    def __init__(self):
+        self.done = False
+    
+    def is_done(self):
+        return self.done
+    
+    async def send_message(self, *args, **kwargs):
+        self.done = True
+        await http.request('POST /interactions/{id}/callback')
+    
+    async def edit_message(self, *args, **kwargs):
+        self.done = True
+        await http.request('POST /interactions/{id}/callback')
+
+class FakeInteraction:
+    def __init__(self, user, guild):
+        self.user = user
+        self.guild = guild
+        self.guild_id = guild.id
+        self.response = FakeResponse()
+
+class FakeContext:
+    def __init__(self, author, channel):
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+    
+    async def send(self, *args, **kwargs):
+        await self.channel.send(*args, **kwargs)
+
+def make_guild(guild_id=1360425755862892667, channels=50):
+    names = ['general', 'memes', 'off-topic', 'staff-chat', '✅・vouches'] + [f'channel-{i}' for i in range(channels - 5)]
+    return FakeGuild(guild_id, 'Benchmark Guild', names)
+
+# ======= SYNTHETIC DATA =======
+class BenchWorld:
+    """Synthetic guilds with users, points and a reward, wired into the bot module"""
+    
+    def __init__(self, guild_count, user_count, cached_fraction):
+        self.guilds = [make_guild(guild_id=(i + 1) << 22) for i in range(guild_count)]
+        self.users = [FakeUser(100000 + i, f'user-{i}') for i in range(user_count)]
+        self.admin = FakeUser(1, 'admin', administrator=True)
+        channels = {channel.id: channel for guild in self.guilds for channel in guild.channels}
+        
+        for guild in self.guilds:
+            guild_id = str(guild.id)
+            vouchbot.get_guild_rewards(guild_id)[REWARD_NAME] = {'cost': 1, 'name': REWARD_NAME}
+            for user in self.users:
+                vouchbot.set_user_points(guild_id, str(user.id), random.randint(0, 1000))
+                if random.random() < cached_fraction:
+                    guild.members[user.id] = user
+        
+        vouchbot.authorized_guilds = frozenset(guild.id for guild in self.guilds)
+        for guild in self.guilds:
+            vouchbot.verification_channels[str(guild.id)] = str(self.verification_channel(guild).id)
+            vouchbot.guild_settings[str(guild.id)] = {'vouch_burst': 10 ** 9}  # Cooldown is checked, never hit
+        vouchbot.bot.get_channel = channels.get
+        vouchbot.bot.fetch_user = self.fetch_user
+    
+    async def fetch_user(self, user_id):
+        await http.request('GET /users/{id}')
+        return FakeUser(user_id, f'user-{user_id}')
+    
+    def pick(self):
+        return random.choice(self.guilds), random.choice(self.users)
+    
+    @staticmethod
+    def chat_channel(guild):
+        return guild.channels[0]
+    
+    @staticmethod
+    def vouch_channel(guild):
+        return guild.channels[4]
+    
+    @staticmethod
+    def verification_channel(guild):
+        return guild.channels[3]
+
+# ======= FLOWS =======
+# Each flow builds a list of zero-argument callables, one per operation, outside the timed section
+def on_message_flow(world, count, content, bot_author=False, unauthorized=False):
+    outsider = make_guild(guild_id=1, channels=5)  # Not on the allowlist
+    bot_user = FakeUser(2, 'other-bot', bot=True)
+    operations = []
+    for i in range(count):
+        guild = outsider if unauthorized else random.choice(world.guilds)
+        author = bot_user if bot_author else world.users[i % len(world.users)]
+        message = FakeMessage(i, author, world.chat_channel(guild), content)
+        operations.append(functools.partial(vouchbot.on_message, message))
+    return operations
+
+# A vouch runs on_message -> rate limiter -> intake queue -> forward_vouch (spool, hash, duplicate
+# index, post for review); an operation lasts until its forward_vouch has finished
+vouches_done = {}  # message_id: future resolved when forward_vouch returns
+forward_vouch = vouchbot.forward_vouch
+
+async def tracked_forward_vouch(message, *args):
+    try:
+        await forward_vouch(message, *args)
+    finally:
+        vouches_done.pop(message.id).set_result(None)
+
+async def post_vouch(message):
+    done = asyncio.get_running_loop().create_future()
+    vouches_done[message.id] = done
+    await vouchbot.on_message(message)
+    await done
+
+def vouch_flow(world, count, image_size, duplicate_fraction):
+    operations = []
+    seeds = []
+    for _ in range(count):
+        guild, user = world.pick()
+        if seeds and random.random() < duplicate_fraction:
+            seed = random.choice(seeds)  # Same image posted again, flagged by the duplicate index
+        else:
+            seed = random.getrandbits(63)
+            seeds.append(seed)
+        message = FakeMessage(next(message_ids), user, world.vouch_channel(guild), '', [FakeAttachment(seed, image_size)])
+        operations.append(functools.partial(post_vouch, message))
+    return operations
+
+def approval_flow(world, count):
+    operations = []
+    for i in range(count):
+        guild, user = world.pick()
+        vouch_id = f"{guild.id}_{user.id}_{i}"
+        vouchbot.add_pending_vouch(vouch_id, {
+            'guild_id': str(guild.id),
+            'user_id': str(user.id),
+            'message_id': i,
+            'channel_id': world.vouch_channel(guild).id,
+            'image_url': 'https://cdn.example/vouch.png',
+            'verification_message_id': i,
+        })
+        view = vouchbot.VouchApprovalView(vouch_id)
+        interaction = FakeInteraction(world.admin, guild)
+        operations.append(functools.partial(view.handle_approval, interaction, approved=i % 4 != 0))
+    return operations
+
+def reward_button_flow(world, count):
+    operations = []
+    for _ in range(count):
+        guild, user = world.pick()
+        button = vouchbot.RewardButton(REWARD_NAME, 1, user.id, str(guild.id))
+        operations.append(functools.partial(button.callback, FakeInteraction(user, guild)))
+    return operations
+
+def redeem_flow(world, count):
+    operations = []
+    for _ in range(count):
+        guild, user = world.pick()
+        ctx = FakeContext(user, world.chat_channel(guild))
+        operations.append(functools.partial(vouchbot.redeem_reward.callback, ctx, reward_name=REWARD_NAME))
+    return operations
+
+def leaderboard_flow(world, count):
+    pages = max(1, len(world.users) // vouchbot.LEADERBOARD_PAGE_SIZE)
+    operations = []
+    for _ in range(count):
+        guild, user = world.pick()
+        ctx = FakeContext(user, world.chat_channel(guild))
+        page = 1 if random.random() < 0.8 else random.randint(1, pages)  # Most people look at the top
+        operations.append(functools.partial(vouchbot.show_leaderboard.callback, ctx, page))
+    return operations
+
+# ======= RUNNER =======
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+async def drive(operations, concurrency):
+    """Run operations on `concurrency` concurrent callers. Returns (elapsed, sorted latencies)"""
+    latencies = []
+    pending = iter(operations)
+    
+    async def caller():
+        for operation in pending:
+            start = time.perf_counter()
+            await operation()
+            latencies.append(time.perf_counter() - start)
+    
+    start = time.perf_counter()
+    await asyncio.gather(*(caller() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return elapsed, latencies
+
+async def bench_flow(label, build, count, memory_count, concurrency):
+    http.calls.clear()
+    elapsed, latencies = await drive(build(count), concurrency)
+    calls = sum(http.calls.values())
+    
+    operations = build(memory_count)
+    tracemalloc.start()
+    await drive(operations, concurrency)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    print(f"{label:<30} {count / elapsed:>12,.0f} ops/s  p50 {percentile(latencies, 0.50) * 1e6:>9.1f} us"
+          f"  p99 {percentile(latencies, 0.99) * 1e6:>9.1f} us  rest/op {calls / count:>5.2f}  peak {peak / 1024:>8.0f} KB")
+
+async def run(args):
+    vouchbot.storage.load()
+    commands_seen = 0
+    async def count_commands(message):
+        nonlocal commands_seen
+        commands_seen += 1
+    vouchbot.bot.process_commands = count_commands  # Measure the bot's own routing, not discord.py's parser
+    vouchbot.get_http_session = lambda: session
+    vouchbot.forward_vouch = tracked_forward_vouch
+    vouchbot.vouch_intake.max_queued = max(vouchbot.vouch_intake.max_queued, args.concurrency)
+    vouchbot.vouch_intake.start()
+    
+    start = time.perf_counter()
+    world = BenchWorld(args.guilds, args.users, args.cached_members)
+    print(f"{args.guilds} guild(s) x {args.users} user(s) set up in {time.perf_counter() - start:.1f}s "
+          f"({vouchbot.STORAGE_BACKEND} storage, concurrency {args.concurrency}, REST latency {args.http_latency_ms} ms)")
+    
+    memory_count = min(args.memory_ops, args.ops)
+    flows = [
+        ('on_message [plain chat]', functools.partial(on_message_flow, world, content='hello there, how is everyone doing today?'), args.messages),
+        ('on_message [bot messages]', functools.partial(on_message_flow, world, content='beep', bot_author=True), args.messages),
+        ('on_message [prefix commands]', functools.partial(on_message_flow, world, content='!points'), args.messages),
+        ('on_message [unauthorized guild]', functools.partial(on_message_flow, world, content='!points', unauthorized=True), args.messages),
+        ('vouch intake [spooled image]', functools.partial(vouch_flow, world, image_size=args.image_kb * 1024,
+                                                           duplicate_fraction=args.duplicates), args.ops),
+        ('handle_approval', functools.partial(approval_flow, world), args.ops),
+        ('RewardButton.callback', functools.partial(reward_button_flow, world), args.ops),
+        ('!redeem', functools.partial(redeem_flow, world), args.ops),
+        ('!leaderboard', functools.partial(leaderboard_flow, world), args.ops),
+    ]
+    for label, build, count in flows:
+        await bench_flow(label, build, count, min(memory_count, count), args.concurrency)
+    print(f"commands routed: {commands_seen}")
+    vouchbot.storage.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the vouch bot")
+    parser.add_argument('--messages', type=int, default=200000, help="messages per on_message scenario")
+    parser.add_argument('--ops', type=int, default=5000, help="operations per approval/reward/leaderboard flow")
+    parser.add_argument('--memory-ops', type=int, default=1000, help="operations in each flow's tracemalloc pass")
+    parser.add_argument('--guilds', type=int, default=10, help="synthetic guilds")
+    parser.add_argument('--users', type=int, default=1000, help="users with points in each guild")
+    parser.add_argument('--cached-members', type=float, default=0.5, help="share of users in the member cache")
+    parser.add_argument('--concurrency', type=int, default=1, help="operations in flight at once")
+    parser.add_argument('--image-kb', type=int, default=256, help="size of each vouch image")
+    parser.add_argument('--duplicates', type=float, default=0.1, help="share of vouch images posted before")
+    parser.add_argument('--http-latency-ms', type=float, default=0, help="latency added to every fake REST call")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    
+    random.seed(args.seed)
+    vouchbot.log.setLevel(logging.WARNING)  # Every vouch logs at INFO, which would be timed too
+    http.latency = args.http_latency_ms / 1000
+    with tempfile.TemporaryDirectory(prefix='vouchbot-bench-') as workdir:
+        os.chdir(workdir)  # Ledger, shards and SQLite files all live under the working directory
+        asyncio.run(run(args))
+
+if __name__ == '__main__':
+    main()
@@ -1,39 +1,387 @@
 import os
+import sys
 import json
+import copy
+import signal
+import subprocess
+import atexit
+import sqlite3
+import threading
+import queue
+import shutil
+import concurrent.futures
+import weakref
+import functools
+import itertools
+from bisect import bisect_left, insort
+from collections import OrderedDict, deque
 import discord
 import asyncio
 import time
-import io
+import tempfile
+import hashlib
+import random
+import traceback
+import math
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import contextlib
+import aiohttp
+import contextvars
+from aiohttp import web
 from discord.ext import commands, tasks
 from discord import ui
 from discord import app_commands
 from dotenv import load_dotenv
+try:
+    import resource  # Peak memory reporting, not available on Windows
+except ImportError:
+    resource = None
+
+PROCESS_STARTED = time.monotonic()
 
 # Load environment variables
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
 
+# ======= LOGGING =======
+# Records are handed to a queue and written by a listener thread, so the event loop never waits on stdout.
+# Debug events logged with extra={'sampled': True} are high volume and only LOG_SAMPLE_RATE of them are kept
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()  # 'text' or 'json'
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0.01'))
+LOG_RECORD_FIELDS = frozenset(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime', 'sampled'}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including any extra= fields"""
+    
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in LOG_RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TracebackQueueHandler(QueueHandler):
+    """QueueHandler that keeps exc_info, so the stdout formatter renders tracebacks itself"""
+    
+    def prepare(self, record):
+        record = copy.copy(record)  # Other handlers may still see the original
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+class SampleFilter(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+    
+    def filter(self, record):
+        return not getattr(record, 'sampled', False) or random.random() < self.rate
+
+def setup_logging():
+    """Route all logging (ours and discord.py's) through a queue to a single stdout writer thread"""
+    handler = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)-8s %(name)s: %(message)s'))
+    log_queue = queue.SimpleQueue()
+    queue_handler = TracebackQueueHandler(log_queue)
+    queue_handler.addFilter(SampleFilter(LOG_SAMPLE_RATE))
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)  # Registered first so it runs last and flushes everything else's output
+    return listener
+
+setup_logging()
+log = logging.getLogger('vouchbot')
+
+# ======= METRICS =======
+# In-process counters, gauges and histograms, served in Prometheus text format on METRICS_PORT (0 = off)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+REVIEW_BUCKETS = (10, 30, 60, 300, 900, 1800, 3600, 4 * 3600, 12 * 3600, 24 * 3600, 7 * 24 * 3600)
+metrics_registry = []
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(label_names, labels, extra=()):
+    pairs = list(zip(label_names, labels)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in pairs) + '}'
+
+class CounterMetric:
+    """Monotonic count per label set"""
+    kind = 'counter'
+    
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.values = {}  # label tuple: count
+        self.lock = threading.Lock()  # Storage threads record metrics too
+        metrics_registry.append(self)
+    
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+    
+    def samples(self):
+        with self.lock:
+            return [(self.name, labels, (), value) for labels, value in self.values.items()]
+
+class GaugeMetric:
+    """Value read at scrape time - collect() returns {label tuple: value}"""
+    kind = 'gauge'
+    
+    def __init__(self, name, help_text, collect, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.collect = collect
+        metrics_registry.append(self)
+    
+    def samples(self):
+        return [(self.name, labels, (), value) for labels, value in self.collect().items()]
+
+class HistogramMetric:
+    """Bucketed observations per label set, rendered as cumulative Prometheus buckets"""
+    kind = 'histogram'
+    
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}  # label tuple: [bucket counts (last is +Inf), sum, count]
+        self.lock = threading.Lock()
+        metrics_registry.append(self)
+    
+    def observe(self, value, *labels):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+    
+    @contextlib.contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+    
+    def samples(self):
+        samples = []
+        with self.lock:
+            for labels, (counts, total, count) in self.series.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    samples.append((f'{self.name}_bucket', labels, (('le', bound),), cumulative))
+                samples.append((f'{self.name}_sum', labels, (), total))
+                samples.append((f'{self.name}_count', labels, (), count))
+        return samples
+
+def render_metrics():
+    lines = []
+    for metric in metrics_registry:
+        lines.append(f'# HELP {metric.name} {metric.help_text}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for name, labels, extra, value in metric.samples():
+            lines.append(f'{name}{format_labels(metric.label_names, labels, extra)} {value}')
+    return '\n'.join(lines) + '\n'
+
+# The flow a coroutine is working for, so REST calls can be attributed to it
+current_flow = contextvars.ContextVar('current_flow', default='other')
+
+command_seconds = HistogramMetric('vouchbot_command_seconds', 'Command handling time', ('kind', 'command'))
+intake_seconds = HistogramMetric('vouchbot_vouch_intake_seconds', 'Vouch posted to verification message sent')
+approval_points_seconds = HistogramMetric('vouchbot_approval_points_seconds', 'Approve click to points stored')
+review_seconds = HistogramMetric('vouchbot_vouch_review_seconds', 'Vouch submitted to approved/denied', ('outcome',), REVIEW_BUCKETS)
+save_seconds = HistogramMetric('vouchbot_save_seconds', 'Persistence step duration', ('stage',))
+rest_calls = CounterMetric('vouchbot_rest_calls_total', 'Discord REST requests', ('flow', 'route'))
+
+# Gateway profile - 'lean' only subscribes to what the bot uses and keeps no member list in memory,
+# 'full' is every intent with a chunked member cache (the old behaviour)
+INTENTS_PROFILE = os.getenv('INTENTS_PROFILE', 'lean').lower()
+MESSAGE_CACHE_SIZE = int(os.getenv('MESSAGE_CACHE_SIZE', '0'))  # Nothing reads cached messages
+
+def build_gateway_options(profile):
+    """Intents and caching options for commands.Bot"""
+    if profile == 'full':
+        return {'intents': discord.Intents.all(), 'chunk_guilds_at_startup': True}
+    intents = discord.Intents.none()
+    intents.guilds = True  # Guild and channel cache, member counts
+    intents.guild_messages = True  # Vouches and prefix commands
+    intents.message_content = True
+    intents.members = True  # Join/leave events; members themselves are fetched on demand, not cached
+    return {
+        'intents': intents,
+        'member_cache_flags': discord.MemberCacheFlags.none(),
+        'chunk_guilds_at_startup': False,
+        'max_messages': MESSAGE_CACHE_SIZE or None,
+    }
+
+# Sharding (opt-in) - SHARDED=1 lets Discord pick the shard count, SHARD_COUNT/SHARD_IDS pin it,
+# e.g. SHARD_COUNT=8 SHARD_IDS=0-3 runs the first half of eight shards in this process
+def parse_shard_ids(spec):
+    """Parse '0-3,6' into [0, 1, 2, 3, 6] - None when unset"""
+    if not spec:
+        return None
+    shard_ids = []
+    for part in spec.split(','):
+        first, _, last = part.strip().partition('-')
+        shard_ids.extend(range(int(first), int(last or first) + 1))
+    return sorted(set(shard_ids))
+
+SHARD_COUNT = int(os.getenv('SHARD_COUNT')) if os.getenv('SHARD_COUNT') else None
+SHARD_IDS = parse_shard_ids(os.getenv('SHARD_IDS'))
+SHARDED = os.getenv('SHARDED', '').lower() in ('1', 'true', 'yes') or SHARD_COUNT is not None or SHARD_IDS is not None
+
+# Cluster mode - CLUSTER_PROCESSES>1 turns this process into a launcher that runs one bot process per
+# shard range; the workers share state through the SQLite backend
+CLUSTER_PROCESSES = int(os.getenv('CLUSTER_PROCESSES', '0'))
+CLUSTER_WORKER = int(os.getenv('CLUSTER_WORKER')) if os.getenv('CLUSTER_WORKER') else None  # Set by the launcher
+CLUSTER_RESTART_MAX_SECONDS = 60
+CLUSTER_STOP_TIMEOUT_SECONDS = 30  # Time a worker gets to flush and disconnect before it is killed
+
+def owns_guild(guild_id):
+    """True if this process runs the shard that receives the guild's events"""
+    if SHARD_COUNT is None or SHARD_IDS is None:
+        return True
+    return (int(guild_id) >> 22) % SHARD_COUNT in SHARD_IDS
+
 # Bot setup with command prefix '!'
-intents = discord.Intents.all()  # Enable all intents
-bot = commands.Bot(command_prefix='!', intents=intents, reconnect=True)
+COMMAND_PREFIX = '!'
+if SHARDED:
+    bot = commands.AutoShardedBot(
+        command_prefix=COMMAND_PREFIX,
+        reconnect=True,
+        shard_count=SHARD_COUNT,
+        shard_ids=SHARD_IDS,
+        **build_gateway_options(INTENTS_PROFILE)
+    )
+else:
+    bot = commands.Bot(command_prefix=COMMAND_PREFIX, reconnect=True, **build_gateway_options(INTENTS_PROFILE))
 
-# Points, rewards, and vouch roles data structure - all guild-specific
-points_data = {}
+# Rewards and vouch roles data structure - all guild-specific (points live in the storage backend)
 rewards_data = {}
 vouch_roles_data = {}
 verification_channels = {}  # guild_id: channel_id
-pending_vouches = {}  # vouch_id: {guild_id, user_id, message_id, channel_id, mentioned_role, image_url}
-# Cooldown tracking - user_id: timestamp
-user_last_vouch_time = {}
-COOLDOWN_MINUTES = 5
+pending_vouches = {}  # guild_id: {vouch_id: {guild_id, user_id, message_id, channel_id, image_url, verification_message_id}}
+pending_views_restored = False
+guild_settings = {}  # guild_id: {setting: value} - only settings that differ from the defaults
+# Vouch cooldown - each user gets VOUCH_BURST vouches, refilled one every COOLDOWN_MINUTES (per guild)
+COOLDOWN_MINUTES = float(os.getenv('COOLDOWN_MINUTES', '5'))
+VOUCH_BURST = int(os.getenv('VOUCH_BURST', '1'))
+RATE_LIMIT_MAX_ENTRIES = int(os.getenv('RATE_LIMIT_MAX_ENTRIES', '100000'))
+
+# Display names of users who aren't in the member cache, used by the leaderboard
+DISPLAY_NAME_CACHE_SIZE = int(os.getenv('DISPLAY_NAME_CACHE_SIZE', '5000'))
+# Guilds whose ranked index stays in memory (JSON backend; SQLite ranks straight from its index)
+RANKING_CACHE_SIZE = int(os.getenv('RANKING_CACHE_SIZE', '100'))
+
+LEADERBOARD_PAGE_SIZE = 10
+PRESENCE_MIN_SECONDS = float(os.getenv('PRESENCE_MIN_SECONDS', '300'))  # Least time between presence changes
+
+# Vouch image forwarding - 'spool' re-uploads a copy streamed through a size-capped temp file,
+# 'url' only references the original attachment (no download or upload at all)
+FORWARD_MODES = ('spool', 'url')
+FORWARD_MODE = os.getenv('FORWARD_MODE', 'spool')
+FORWARD_MAX_BYTES = int(os.getenv('FORWARD_MAX_BYTES', str(25 * 1024 * 1024)))
+FORWARD_SPOOL_MEMORY_BYTES = int(os.getenv('FORWARD_SPOOL_MEMORY_BYTES', str(1024 * 1024)))  # Larger files go to disk
+FORWARD_CONCURRENCY = int(os.getenv('FORWARD_CONCURRENCY', '4'))
+FORWARD_CHUNK_BYTES = 64 * 1024
+forward_slots = asyncio.Semaphore(FORWARD_CONCURRENCY)
+http_session = None  # aiohttp session for streaming attachment downloads
+
+# Vouch intake - forwarding runs on a fixed worker pool fed by a bounded queue
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
+INTAKE_WORKERS = int(os.getenv('INTAKE_WORKERS', '8'))
+INTAKE_QUEUE_SIZE = int(os.getenv('INTAKE_QUEUE_SIZE', '200'))
+INTAKE_GUILD_CONCURRENCY = int(os.getenv('INTAKE_GUILD_CONCURRENCY', '2'))  # Vouches in flight per guild
+
+# Duplicate vouch images - 'flag' marks them for reviewers, 'reject' refuses them, 'off' doesn't check.
+# Images are matched on the sha256 of spooled copies; size + filename + dimensions (no download needed) only flag
+DUPLICATE_MODES = ('off', 'flag', 'reject')
+DUPLICATE_MODE = os.getenv('DUPLICATE_MODE', 'flag')
+IMAGE_HASH_CACHE_SIZE = int(os.getenv('IMAGE_HASH_CACHE_SIZE', '50000'))
+
+# Per-guild settings and their defaults
+DEFAULT_GUILD_SETTINGS = {
+    'forward_mode': FORWARD_MODE,
+    'intake_concurrency': INTAKE_GUILD_CONCURRENCY,
+    'cooldown_minutes': COOLDOWN_MINUTES,
+    'vouch_burst': VOUCH_BURST,
+    'duplicate_mode': DUPLICATE_MODE,
+}
+
+# Storage backend - 'json' (files + points ledger) or 'sqlite'
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json').lower()
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'vouchbot.db')
+
+# Points persistence - every change is appended to the ledger, the guild shards are periodic snapshots
+POINTS_LEDGER_FILE = 'points.ledger'
+LEDGER_FSYNC_SECONDS = float(os.getenv('LEDGER_FSYNC_SECONDS', '1'))
+LEDGER_COMPACT_RECORDS = int(os.getenv('LEDGER_COMPACT_RECORDS', '5000'))
+
+# JSON backend layout - one file per guild under DATA_DIR/<document>/, changed guilds are
+# flushed at most once every SAVE_DEBOUNCE_SECONDS
+DATA_DIR = os.getenv('DATA_DIR', 'data')
+SAVE_DEBOUNCE_SECONDS = float(os.getenv('SAVE_DEBOUNCE_SECONDS', '2'))
+DOCUMENTS = ('points', 'rewards', 'vouch_roles', 'verification_channels', 'pending_vouches', 'guild_settings')
+# Single-file layout from older versions, split into guild shards on first start
+LEGACY_FILES = {
+    'points': 'points.json',
+    'rewards': 'rewards.json',
+    'vouch_roles': 'vouch_roles.json',
+    'verification_channels': 'verification_channels.json',
+}
+
+# Hashes of the slash command payloads last synced to Discord (global and per guild) - unchanged
+# commands aren't re-synced. DEV_GUILD_ID also syncs to that guild, where changes show up instantly
+COMMAND_SYNC_FILE = os.getenv('COMMAND_SYNC_FILE', 'command_sync.json')
+DEV_GUILD_ID = int(os.getenv('DEV_GUILD_ID', '0')) or None
+
+# Guild allowlist - {"servers": [guild ids]}, a missing or empty list allows every guild.
+# Re-read when the file changes, AUTO_LEAVE_UNAUTHORIZED makes the bot leave guilds not on it
+AUTHORIZED_SERVERS_FILE = os.getenv('AUTHORIZED_SERVERS_FILE', 'authorized_servers.json')
+ALLOWLIST_RELOAD_SECONDS = float(os.getenv('ALLOWLIST_RELOAD_SECONDS', '30'))
+AUTO_LEAVE_UNAUTHORIZED = os.getenv('AUTO_LEAVE_UNAUTHORIZED', '').lower() in ('1', 'true', 'yes')
+authorized_guilds = None  # frozenset of guild ids, None when every guild is allowed
+authorized_servers_mtime = None
+
+# Event loop watchdog - loop lag is always measured. SLOW_HANDLER_SECONDS > 0 also profiles handlers:
+# a thread dumps the loop thread's stack when the loop stops answering for that long, and handlers
+# still running after that long get their coroutine stack dumped. Reports go to PROFILE_DIR
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '1'))
+LOOP_LAG_WARN_SECONDS = float(os.getenv('LOOP_LAG_WARN_SECONDS', '0.25'))
+SLOW_HANDLER_SECONDS = float(os.getenv('SLOW_HANDLER_SECONDS', '0'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_MAX_REPORTS = int(os.getenv('PROFILE_MAX_REPORTS', '200'))  # Per process, keeps the directory bounded
 
 # Guild-specific helper functions for points
 def get_guild_points(guild_id):
     """Get points data for a specific guild"""
-    guild_id = str(guild_id)
-    if guild_id not in points_data:
-        points_data[guild_id] = {}
-    return points_data[guild_id]
+    return storage.get_guild_points(str(guild_id))
 
 def get_guild_rewards(guild_id):
     """Get rewards data for a specific guild"""
@@ -47,82 +395,786 @@ def get_guild_vouch_roles(guild_id):
     guild_id = str(guild_id)
     if guild_id not in vouch_roles_data:
         vouch_roles_data[guild_id] = ["CHEF"]  # Default to "CHEF" role for NEW guilds only
-        save_vouch_roles()  # Save immediately to ensure persistence
+        save_vouch_roles(guild_id)  # Save immediately to ensure persistence
     return vouch_roles_data[guild_id].copy()  # Return a copy to prevent reference issues
 
 def get_user_points(guild_id, user_id):
     """Get points for a specific user in a specific guild"""
-    guild_points = get_guild_points(guild_id)
-    return guild_points.get(str(user_id), 0)
+    return storage.get_user_points(str(guild_id), str(user_id))
 
 def set_user_points(guild_id, user_id, points):
     """Set points for a specific user in a specific guild"""
-    guild_points = get_guild_points(guild_id)
-    guild_points[str(user_id)] = points
-    save_points()
+    storage.set_user_points(str(guild_id), str(user_id), points)
+
+class LRUCache:
+    """Small dict-like cache that evicts the least recently used entry past max_size"""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+    
+    def get(self, key, default=None):
+        if key not in self.entries:
+            return default
+        self.entries.move_to_end(key)
+        return self.entries[key]
+    
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+    
+    def __len__(self):
+        return len(self.entries)
+
+display_name_cache = LRUCache(DISPLAY_NAME_CACHE_SIZE)
+
+async def resolve_display_names(guild, user_ids):
+    """Map user IDs to display names - member cache first, then one concurrent round of fetches"""
+    names = {}
+    missing = []
+    for user_id in user_ids:
+        member = guild.get_member(int(user_id))
+        if member is not None:
+            names[user_id] = member.display_name
+            continue
+        cached = display_name_cache.get(user_id)
+        if cached is None:
+            user = bot.get_user(int(user_id))
+            cached = user.display_name if user is not None else None
+        if cached is not None:
+            names[user_id] = cached
+        else:
+            missing.append(user_id)
+    
+    if missing:
+        users = await asyncio.gather(*(bot.fetch_user(int(user_id)) for user_id in missing), return_exceptions=True)
+        for user_id, user in zip(missing, users):
+            if isinstance(user, Exception):
+                continue
+            names[user_id] = user.display_name
+            display_name_cache.put(user_id, user.display_name)
+    return names
+
+# Point transactions - one lock per (guild, user) so unrelated users and guilds never wait on each other
+point_locks = weakref.WeakValueDictionary()  # (guild_id, user_id): asyncio.Lock, dropped once unused
+
+def points_lock(guild_id, user_id):
+    """Get the lock that serializes point changes for one user in one guild"""
+    key = (str(guild_id), str(user_id))
+    lock = point_locks.get(key)
+    if lock is None:
+        lock = asyncio.Lock()
+        point_locks[key] = lock
+    return lock
 
-def add_user_points(guild_id, user_id, points_to_add):
-    """Add points to a specific user in a specific guild"""
-    current_points = get_user_points(guild_id, user_id)
-    set_user_points(guild_id, user_id, current_points + points_to_add)
+def apply_point_delta(current_points, delta, min_balance=None, clamp=False):
+    """New balance after delta, or None if it would drop below min_balance and clamp is off"""
+    new_points = current_points + delta
+    if min_balance is not None and new_points < min_balance:
+        if not clamp:
+            return None
+        new_points = min_balance
+    return new_points
+
+async def adjust_points(guild_id, user_id, delta, min_balance=None, clamp=False):
+    """Atomically change a user's points. Returns (applied, balance) - balance is unchanged if not applied"""
+    async with points_lock(guild_id, user_id):
+        return await storage.adjust_points(str(guild_id), str(user_id), delta, min_balance, clamp)
+
+# Ranked index - per-guild users ordered by points for the JSON backend, built on first use and kept current on every change
+class GuildRanking:
+    """Users of one guild sorted by points (highest first) for top-K, paging and O(log n) rank lookups"""
+    def __init__(self, guild_points):
+        self.points = dict(guild_points)
+        # (-points, user_id) so ascending order is highest points first
+        self.keys = sorted((-points, user_id) for user_id, points in self.points.items())
+    
+    def update(self, user_id, points):
+        old_points = self.points.get(user_id)
+        if old_points == points:
+            return
+        if old_points is not None:
+            del self.keys[bisect_left(self.keys, (-old_points, user_id))]
+        self.points[user_id] = points
+        insort(self.keys, (-points, user_id))
+    
+    def rank(self, user_id):
+        """1-based rank (ties share a rank), or None if the user has no points entry"""
+        points = self.points.get(user_id)
+        if points is None:
+            return None
+        return bisect_left(self.keys, (-points, '')) + 1
+    
+    def page(self, start, count):
+        return [(user_id, -negative_points) for negative_points, user_id in self.keys[start:start + count]]
+    
+    def __len__(self):
+        return len(self.keys)
+
+async def get_guild_ranking(guild_id):
+    """Get a guild's ranking - rank(user_id), page(start, count) and len()"""
+    return await storage.guild_ranking(str(guild_id))
 
 # File operations
-def load_points():
+def read_json_file(path):
+    """Read a JSON file, treating a missing file as empty"""
+    if path is None:
+        return {}
     try:
-        with open('points.json', 'r') as f:
-            data = json.load(f)
-            # Convert old format to guild-specific format if needed
-            if data and not any(str(k).isdigit() and len(str(k)) > 15 for k in data.keys()):
-                # Old format detected, return as-is for backward compatibility
-                return data
-            return data
+        with open(path, 'r') as f:
+            return json.load(f)
     except FileNotFoundError:
         return {}
 
-def save_points():
-    with open('points.json', 'w') as f:
-        json.dump(points_data, f, indent=4)
+def write_text_atomic(path, text):
+    """Write to a temp file and rename it over the target so readers never see a partial file"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def write_json_atomic(path, data):
+    write_text_atomic(path, json.dumps(data, indent=4))
+
+def shard_path(name, guild_id):
+    return os.path.join(DATA_DIR, name, f"{guild_id}.json")
+
+def read_shards(name):
+    """Read every guild shard of a document, falling back to its legacy single file"""
+    directory = os.path.join(DATA_DIR, name)
+    if not os.path.isdir(directory):
+        return read_json_file(LEGACY_FILES.get(name))
+    data = {}
+    for filename in os.listdir(directory):
+        if filename.endswith('.json'):
+            data[filename[:-len('.json')]] = read_json_file(os.path.join(directory, filename))
+    return data
+
+def migrate_legacy_file(name):
+    """Split a legacy single-file document into guild shards - the directory appears all at once"""
+    directory = os.path.join(DATA_DIR, name)
+    if os.path.isdir(directory):
+        return
+    tmp_directory = f"{directory}.migrating"
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+    for guild_id, value in read_json_file(LEGACY_FILES.get(name)).items():
+        write_json_atomic(os.path.join(tmp_directory, f"{guild_id}.json"), value)
+    os.replace(tmp_directory, directory)
+
+class FileWriter(threading.Thread):
+    """Worker thread that writes files atomically, keeping only the newest pending content per file"""
+    def __init__(self):
+        super().__init__(name='file-writer', daemon=True)
+        self.pending = {}  # path: serialized content waiting to be written
+        self.condition = threading.Condition()
+        self.stopping = False
+    
+    def submit(self, path, text):
+        """Queue content for path - None deletes the file"""
+        with self.condition:
+            self.pending[path] = text  # Replaces any older content that hasn't been written yet
+            self.condition.notify()
+    
+    def stop(self):
+        """Write everything still pending, then stop the thread"""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        self.join()
+    
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopping:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                path, text = self.pending.popitem()
+            try:
+                if text is None:
+                    os.remove(path)
+                else:
+                    with save_seconds.time('file_write'):
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        write_text_atomic(path, text)
+            except FileNotFoundError:
+                pass
+            except Exception:
+                log.exception("Error writing %s", path)
+
+class PointsLedger:
+    """Append-only log of point changes, replayed on top of the points.json snapshot"""
+    def __init__(self, path):
+        self.path = path
+        self.compacting_path = f"{path}.compacting"  # Rotated ledgers: .compacting, then .compacting.1, .2, ...
+        self.segments = []  # Rotated ledgers no snapshot covers yet, oldest first
+        self.file = None
+        self.records = 0  # Records on disk (live ledger and rotated ones) since the last compaction
+        self.unsynced = False
+        self.replayed_guilds = set()  # Guilds that had records on disk at the last replay
+    
+    def open(self):
+        if self.file is None:
+            # Binary mode so the buffered writer can be fsynced from a worker thread safely
+            self.file = open(self.path, 'ab')
+    
+    def append(self, guild_id, user_id, delta, total):
+        """Record one point change - the new total makes replay idempotent"""
+        self.open()
+        record = json.dumps({'g': guild_id, 'u': user_id, 'd': delta, 'p': total}, separators=(',', ':'))
+        self.file.write(record.encode('utf-8') + b'\n')
+        self.file.flush()  # Handed to the OS right away so a killed process keeps it, only the fsync is batched
+        self.records += 1
+        self.unsynced = True
+    
+    def flush(self):
+        """Hand buffered records to the OS without waiting for the disk"""
+        if self.file is not None:
+            self.file.flush()
+    
+    def sync(self):
+        """Flush buffered records and fsync them to disk"""
+        if self.file is None or not self.unsynced:
+            return
+        self.unsynced = False
+        self.file.flush()
+        os.fsync(self.file.fileno())
+    
+    def segment_path(self, number):
+        return self.compacting_path if number == 0 else f"{self.compacting_path}.{number}"
+    
+    def segment_number(self, path):
+        return 0 if path == self.compacting_path else int(path.rsplit('.', 1)[1])
+    
+    def find_segments(self):
+        """Rotated ledgers left behind by compactions that didn't finish, oldest first"""
+        directory = os.path.dirname(self.compacting_path) or '.'
+        prefix = os.path.basename(self.compacting_path)
+        numbers = []
+        for name in os.listdir(directory):
+            if name == prefix:
+                numbers.append(0)
+            elif name.startswith(prefix + '.') and name[len(prefix) + 1:].isdigit():
+                numbers.append(int(name[len(prefix) + 1:]))
+        return [self.segment_path(number) for number in sorted(numbers)]
+    
+    def replay(self, data):
+        """Apply the rotated ledgers and the live one on top of a loaded snapshot"""
+        self.flush()
+        self.segments = self.find_segments()
+        self.records = 0
+        for path in self.segments + [self.path]:
+            try:
+                with open(path, 'rb') as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            continue  # Torn final line from a crash mid-append
+                        data.setdefault(record['g'], {})[record['u']] = record['p']
+                        self.replayed_guilds.add(record['g'])
+                        self.records += 1  # Counts towards compaction, or restarts would keep it from ever running
+            except FileNotFoundError:
+                pass
+        return data
+    
+    def rotate(self):
+        """Move the live ledger aside so a snapshot can replace it, returning the rotated ledgers the
+        snapshot has to cover. Only a rename - records are never copied - and it stays on the event loop
+        so no append can land between closing the file and renaming it"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.unsynced = False
+        self.records = 0
+        if os.path.exists(self.path):
+            # After a failed compaction the older segments are kept and this one is added after them
+            number = self.segment_number(self.segments[-1]) + 1 if self.segments else 0
+            os.replace(self.path, self.segment_path(number))
+            self.segments.append(self.segment_path(number))
+        return list(self.segments)
+    
+    def finish_compaction(self, segments):
+        """Drop rotated ledgers once the snapshot that covers them is on disk"""
+        for path in segments:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.segments = [path for path in self.segments if path not in segments]
+    
+    def close(self):
+        self.sync()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+# ======= STORAGE BACKENDS =======
+# Both backends expose the same API: load/close, per-user points and guild-keyed documents
+# for rewards, vouch roles and verification channels.
+class DirtyTracker:
+    """Remembers which guilds changed per document and flushes them at most once per SAVE_DEBOUNCE_SECONDS"""
+    def __init__(self, write_shards):
+        self.write_shards = write_shards  # write_shards(name, {guild_id: serialized JSON or None to delete})
+        self.dirty = {}  # name: (data, set of changed guild ids)
+        self.handle = None
+    
+    def mark(self, name, data, guild_id=None):
+        guild_ids = self.dirty[name][1] if name in self.dirty else set()
+        if guild_id is None:
+            guild_ids.update(data.keys())
+        else:
+            guild_ids.add(str(guild_id))
+        self.dirty[name] = (data, guild_ids)
+        if self.handle is not None:
+            return
+        try:
+            self.handle = asyncio.get_running_loop().call_later(SAVE_DEBOUNCE_SECONDS, self.flush)
+        except RuntimeError:
+            self.flush()
+    
+    def flush(self):
+        """Serialize only the changed guilds and hand them to the backend writer"""
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        dirty, self.dirty = self.dirty, {}
+        for name, (data, guild_ids) in dirty.items():
+            shards = {}
+            with save_seconds.time('serialize'):
+                for guild_id in guild_ids:
+                    shards[guild_id] = json.dumps(data[guild_id], indent=4) if guild_id in data else None
+            self.write_shards(name, shards)
+
+class JsonStorage:
+    """Per-guild JSON shards under DATA_DIR, with points changes kept in the ledger between snapshots"""
+    def __init__(self):
+        self.points = {}
+        self.dirty_point_guilds = set()  # Guilds whose points shard is older than the ledger
+        self.ledger = PointsLedger(POINTS_LEDGER_FILE)
+        self.file_writer = FileWriter()
+        self.tracker = DirtyTracker(self._write_shards)
+        self.rankings = LRUCache(RANKING_CACHE_SIZE)  # guild_id: GuildRanking, built on first use
+        self.loaded = False
+    
+    def load(self):
+        if self.loaded:
+            return
+        for name in DOCUMENTS:
+            migrate_legacy_file(name)
+        self.points = self.ledger.replay(read_shards('points'))
+        self.dirty_point_guilds.update(self.ledger.replayed_guilds)
+        self.ledger.open()
+        self.file_writer.start()
+        self.loaded = True
+    
+    def get_guild_points(self, guild_id):
+        if guild_id not in self.points:
+            self.points[guild_id] = {}
+        return self.points[guild_id]
+    
+    def get_user_points(self, guild_id, user_id):
+        return self.points.get(guild_id, {}).get(user_id, 0)
+    
+    def set_user_points(self, guild_id, user_id, points):
+        guild_points = self.get_guild_points(guild_id)
+        delta = points - guild_points.get(user_id, 0)
+        guild_points[user_id] = points
+        self.dirty_point_guilds.add(guild_id)
+        self.ledger.append(guild_id, user_id, delta, points)
+        ranking = self.rankings.get(guild_id)
+        if ranking is not None:
+            ranking.update(user_id, points)
+    
+    async def guild_ranking(self, guild_id):
+        ranking = self.rankings.get(guild_id)
+        if ranking is None:
+            ranking = GuildRanking(self.get_guild_points(guild_id))
+            self.rankings.put(guild_id, ranking)
+        return ranking
+    
+    async def adjust_points(self, guild_id, user_id, delta, min_balance, clamp):
+        # Read and write happen with no await in between, so this is atomic on the event loop
+        current_points = self.get_user_points(guild_id, user_id)
+        new_points = apply_point_delta(current_points, delta, min_balance, clamp)
+        if new_points is None:
+            return False, current_points
+        self.set_user_points(guild_id, user_id, new_points)
+        return True, new_points
+    
+    def load_document(self, name):
+        return read_shards(name)
+    
+    def save_document(self, name, data, guild_id=None):
+        """Mark a guild's shard dirty (every guild if guild_id is None) for the next debounced flush"""
+        self.tracker.mark(name, data, guild_id)
+    
+    def _write_shards(self, name, shards):
+        for guild_id, text in shards.items():
+            self.file_writer.submit(shard_path(name, guild_id), text)
+    
+    async def maintain(self):
+        """Batch the ledger fsync and compact it once it grows large enough"""
+        with save_seconds.time('ledger_fsync'):
+            await asyncio.to_thread(self.ledger.sync)
+        if self.ledger.records >= LEDGER_COMPACT_RECORDS:
+            with save_seconds.time('compact'):
+                await self.compact()
+    
+    async def compact(self):
+        """Fold the ledger into fresh shards for the guilds it touched without blocking the event loop"""
+        snapshot = {guild_id: dict(self.points[guild_id]) for guild_id in self.dirty_point_guilds}
+        self.dirty_point_guilds = set()
+        segments = self.ledger.rotate()
+        try:
+            await asyncio.to_thread(self._write_snapshot, snapshot, segments)
+        except Exception:
+            self.dirty_point_guilds.update(snapshot)  # The rotated ledgers are kept, retry next time
+            raise
+    
+    def _write_snapshot(self, snapshot, segments):
+        os.makedirs(os.path.join(DATA_DIR, 'points'), exist_ok=True)
+        for guild_id, users in snapshot.items():
+            write_json_atomic(shard_path('points', guild_id), users)
+        self.ledger.finish_compaction(segments)
+    
+    def close(self):
+        self.tracker.flush()
+        if self.file_writer.is_alive():
+            self.file_writer.stop()
+        else:
+            # Never started - drain pending writes inline
+            self.file_writer.stopping = True
+            self.file_writer.run()
+        self.ledger.close()
+
+def connect_sqlite(path):
+    """Open a SQLite connection in WAL mode with autocommit (transactions are explicit)"""
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA busy_timeout=5000')
+    return conn
+
+class SqliteWriter(threading.Thread):
+    """Owns the SQLite write connection and commits queued operations in batches"""
+    BATCH_SIZE = 500
+    
+    def __init__(self, path):
+        super().__init__(name='sqlite-writer', daemon=True)
+        self.path = path
+        self.queue = queue.Queue()
+    
+    def submit(self, operation):
+        """Queue operation(conn) for the writer thread - returns a concurrent Future"""
+        future = concurrent.futures.Future()
+        self.queue.put((operation, future))
+        return future
+    
+    def stop(self):
+        self.queue.put(None)
+        self.join()
+    
+    def run(self):
+        conn = connect_sqlite(self.path)
+        running = True
+        while running:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.BATCH_SIZE:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            with save_seconds.time('sqlite_commit'):
+                self._commit_batch(conn, batch)
+        conn.close()
+    
+    def _commit_batch(self, conn, batch):
+        results = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for operation, future in batch:
+                try:
+                    results.append((future, operation(conn), None))
+                except Exception as e:
+                    results.append((future, None, e))
+            conn.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            log.exception("Error committing SQLite batch of %d write(s)", len(batch))
+            results = [(future, None, e) for _, future in batch]
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS points (
+    guild_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    points INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, user_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS points_by_score ON points (guild_id, points DESC);
+CREATE TABLE IF NOT EXISTS documents (
+    name TEXT NOT NULL,
+    guild_id TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (name, guild_id)
+) WITHOUT ROWID;
+"""
+
+def _prepare_sqlite(conn):
+    """Create the schema and import existing JSON data into an empty database"""
+    for statement in SQLITE_SCHEMA.split(';'):
+        if statement.strip():
+            conn.execute(statement)
+    if conn.execute('SELECT 1 FROM points LIMIT 1').fetchone() is None:
+        json_points = PointsLedger(POINTS_LEDGER_FILE).replay(read_shards('points'))
+        conn.executemany(
+            'INSERT INTO points (guild_id, user_id, points) VALUES (?, ?, ?)',
+            [(guild_id, user_id, points) for guild_id, users in json_points.items() for user_id, points in users.items()]
+        )
+    for name in DOCUMENTS:
+        if name == 'points':
+            continue
+        if conn.execute('SELECT 1 FROM documents WHERE name = ? LIMIT 1', (name,)).fetchone() is None:
+            conn.executemany(
+                'INSERT INTO documents (name, guild_id, value) VALUES (?, ?, ?)',
+                [(name, guild_id, json.dumps(value)) for guild_id, value in read_shards(name).items()]
+            )
+
+class SqlRanking:
+    """A guild's ranking answered from the points_by_score index, so no guild is ever held in memory"""
+    def __init__(self, conn, guild_id):
+        self.conn = conn
+        self.guild_id = guild_id
+    
+    def rank(self, user_id):
+        """1-based rank (ties share a rank), or None if the user has no points entry"""
+        row = self.conn.execute(
+            'SELECT points FROM points WHERE guild_id = ? AND user_id = ?', (self.guild_id, user_id)
+        ).fetchone()
+        if row is None:
+            return None
+        higher, = self.conn.execute(
+            'SELECT COUNT(*) FROM points WHERE guild_id = ? AND points > ?', (self.guild_id, row[0])
+        ).fetchone()
+        return higher + 1
+    
+    def page(self, start, count):
+        # The index is (guild_id, points DESC, user_id), so this walks it in order - no sort
+        return self.conn.execute(
+            'SELECT user_id, points FROM points WHERE guild_id = ? ORDER BY points DESC, user_id LIMIT ? OFFSET ?',
+            (self.guild_id, count, start)
+        ).fetchall()
+    
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM points WHERE guild_id = ?', (self.guild_id,)).fetchone()[0]
+
+class SqliteStorage:
+    """SQLite (WAL) backend - points are indexed rows written by a dedicated writer thread"""
+    def __init__(self, path):
+        self.path = path
+        self.writer = None
+        self.reader = None
+        self.pending = {}  # (guild_id, user_id): points queued but not yet committed
+        self.pending_lock = threading.Lock()
+        self.tracker = DirtyTracker(self._write_shards)
+    
+    def load(self):
+        if self.reader is not None:
+            return
+        self.writer = SqliteWriter(self.path)
+        self.writer.start()
+        self.writer.submit(_prepare_sqlite).result()
+        self.reader = connect_sqlite(self.path)
+    
+    def get_guild_points(self, guild_id):
+        rows = self.reader.execute('SELECT user_id, points FROM points WHERE guild_id = ?', (guild_id,))
+        guild_points = dict(rows)
+        with self.pending_lock:
+            for (pending_guild_id, user_id), points in self.pending.items():
+                if pending_guild_id == guild_id:
+                    guild_points[user_id] = points
+        return guild_points
+    
+    def get_user_points(self, guild_id, user_id):
+        with self.pending_lock:
+            if (guild_id, user_id) in self.pending:
+                return self.pending[(guild_id, user_id)]
+        row = self.reader.execute(
+            'SELECT points FROM points WHERE guild_id = ? AND user_id = ?', (guild_id, user_id)
+        ).fetchone()
+        return row[0] if row else 0
+    
+    def set_user_points(self, guild_id, user_id, points):
+        key = (guild_id, user_id)
+        with self.pending_lock:
+            self.pending[key] = points
+        future = self.writer.submit(lambda conn: conn.execute(
+            'INSERT INTO points (guild_id, user_id, points) VALUES (?, ?, ?) '
+            'ON CONFLICT (guild_id, user_id) DO UPDATE SET points = excluded.points',
+            (guild_id, user_id, points)
+        ))
+        future.add_done_callback(lambda _: self._committed(key, points))
+    
+    async def adjust_points(self, guild_id, user_id, delta, min_balance, clamp):
+        def adjust(conn):
+            # Runs inside the writer's transaction, after every write queued before it
+            row = conn.execute(
+                'SELECT points FROM points WHERE guild_id = ? AND user_id = ?', (guild_id, user_id)
+            ).fetchone()
+            current_points = row[0] if row else 0
+            new_points = apply_point_delta(current_points, delta, min_balance, clamp)
+            if new_points is None:
+                return False, current_points
+            conn.execute(
+                'INSERT INTO points (guild_id, user_id, points) VALUES (?, ?, ?) '
+                'ON CONFLICT (guild_id, user_id) DO UPDATE SET points = excluded.points',
+                (guild_id, user_id, new_points)
+            )
+            return True, new_points
+        return await asyncio.wrap_future(self.writer.submit(adjust))
+    
+    async def guild_ranking(self, guild_id):
+        # Let every write queued so far commit first, so the reader ranks the current points
+        await asyncio.wrap_future(self.writer.submit(lambda conn: None))
+        return SqlRanking(self.reader, guild_id)
+    
+    def _committed(self, key, points):
+        with self.pending_lock:
+            if self.pending.get(key) == points:
+                del self.pending[key]
+    
+    def load_document(self, name):
+        rows = self.reader.execute('SELECT guild_id, value FROM documents WHERE name = ?', (name,))
+        return {guild_id: json.loads(value) for guild_id, value in rows}
+    
+    def save_document(self, name, data, guild_id=None):
+        """Mark a guild's row dirty (every guild if guild_id is None) for the next debounced flush"""
+        self.tracker.mark(name, data, guild_id)
+    
+    def _write_shards(self, name, shards):
+        upserts = [(name, guild_id, text) for guild_id, text in shards.items() if text is not None]
+        deletes = [(name, guild_id) for guild_id, text in shards.items() if text is None]
+        def write(conn):
+            conn.executemany(
+                'INSERT INTO documents (name, guild_id, value) VALUES (?, ?, ?) '
+                'ON CONFLICT (name, guild_id) DO UPDATE SET value = excluded.value',
+                upserts
+            )
+            conn.executemany('DELETE FROM documents WHERE name = ? AND guild_id = ?', deletes)
+        self.writer.submit(write)
+    
+    async def maintain(self):
+        pass  # The writer thread commits continuously
+    
+    def close(self):
+        if self.writer is not None:
+            self.tracker.flush()
+            self.writer.stop()
+            self.writer = None
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+def create_storage():
+    """Build the storage backend selected by STORAGE_BACKEND"""
+    if STORAGE_BACKEND == 'sqlite':
+        return SqliteStorage(SQLITE_PATH)
+    return JsonStorage()
+
+storage = create_storage()
+atexit.register(storage.close)
 
 def load_rewards():
-    try:
-        with open('rewards.json', 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
+    return storage.load_document('rewards')
 
-def save_rewards():
-    with open('rewards.json', 'w') as f:
-        json.dump(rewards_data, f, indent=4)
+def save_rewards(guild_id=None):
+    storage.save_document('rewards', rewards_data, guild_id)
 
 def load_vouch_roles():
-    try:
-        with open('vouch_roles.json', 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
+    return storage.load_document('vouch_roles')
 
-def save_vouch_roles():
-    with open('vouch_roles.json', 'w') as f:
-        json.dump(vouch_roles_data, f, indent=4)
+def save_vouch_roles(guild_id=None):
+    storage.save_document('vouch_roles', vouch_roles_data, guild_id)
 
 def reset_guild_vouch_roles(guild_id):
     """Reset vouch roles for a specific guild to default"""
     guild_id = str(guild_id)
     vouch_roles_data[guild_id] = ["CHEF"]
-    save_vouch_roles()
+    save_vouch_roles(guild_id)
 
 def load_verification_channels():
     """Load verification channel settings"""
-    try:
-        with open('verification_channels.json', 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
+    return storage.load_document('verification_channels')
 
-def save_verification_channels():
+def save_verification_channels(guild_id=None):
     """Save verification channel settings"""
-    with open('verification_channels.json', 'w') as f:
-        json.dump(verification_channels, f, indent=4)
+    storage.save_document('verification_channels', verification_channels, guild_id)
+
+def load_pending_vouches():
+    """Load vouches still waiting for approval"""
+    return storage.load_document('pending_vouches')
+
+def save_pending_vouches(guild_id=None):
+    """Save vouches still waiting for approval"""
+    storage.save_document('pending_vouches', pending_vouches, guild_id)
+
+def vouch_guild_id(vouch_id):
+    """Vouch IDs start with the guild ID: <guild_id>_<user_id>_<message_id>"""
+    return vouch_id.split('_', 1)[0]
+
+def get_pending_vouch(vouch_id):
+    """Get a pending vouch by ID, or None if it was already processed"""
+    return pending_vouches.get(vouch_guild_id(vouch_id), {}).get(vouch_id)
+
+def add_pending_vouch(vouch_id, vouch_data):
+    """Store a vouch that is waiting for approval"""
+    guild_id = vouch_guild_id(vouch_id)
+    pending_vouches.setdefault(guild_id, {})[vouch_id] = vouch_data
+    save_pending_vouches(guild_id)
+
+def remove_pending_vouch(vouch_id):
+    """Remove a pending vouch and return its data, or None if it was already processed"""
+    guild_id = vouch_guild_id(vouch_id)
+    guild_pending = pending_vouches.get(guild_id, {})
+    vouch_data = guild_pending.pop(vouch_id, None)
+    if not guild_pending:
+        pending_vouches.pop(guild_id, None)
+    if vouch_data is not None:
+        save_pending_vouches(guild_id)
+    return vouch_data
+
+def restore_pending_vouches():
+    """Load pending vouches and re-register their approval buttons - O(pending), no message fetches"""
+    global pending_vouches, pending_views_restored
+    if pending_views_restored:
+        return 0
+    # Vouches of guilds served by other processes stay with them
+    pending_vouches = {guild_id: guild_pending for guild_id, guild_pending in load_pending_vouches().items() if owns_guild(guild_id)}
+    restored = 0
+    for guild_pending in pending_vouches.values():
+        for vouch_id, vouch_data in guild_pending.items():
+            message_id = vouch_data.get('verification_message_id')
+            bot.add_view(VouchApprovalView(vouch_id), message_id=int(message_id) if message_id else None)
+            restored += 1
+    pending_views_restored = True
+    return restored
 
 def get_verification_channel(guild_id):
     """Get verification channel ID for a guild"""
@@ -133,13 +1185,183 @@ def set_verification_channel(guild_id, channel_id):
     """Set verification channel for a guild"""
     guild_id = str(guild_id)
     verification_channels[guild_id] = str(channel_id)
-    save_verification_channels()
+    save_verification_channels(guild_id)
+
+def load_guild_settings():
+    """Load per-guild settings"""
+    return storage.load_document('guild_settings')
+
+def save_guild_settings(guild_id=None):
+    """Save per-guild settings"""
+    storage.save_document('guild_settings', guild_settings, guild_id)
+
+def get_guild_setting(guild_id, key):
+    """Get a guild's setting, falling back to the default"""
+    return guild_settings.get(str(guild_id), {}).get(key, DEFAULT_GUILD_SETTINGS[key])
+
+def set_guild_setting(guild_id, key, value):
+    """Set a guild's setting"""
+    guild_id = str(guild_id)
+    guild_settings.setdefault(guild_id, {})[key] = value
+    save_guild_settings(guild_id)
+
+# Vouch image forwarding
+def get_http_session():
+    global http_session
+    if http_session is None or http_session.closed:
+        http_session = aiohttp.ClientSession()
+    return http_session
+
+async def spool_attachment(attachment, digest=None):
+    """Stream an attachment into a temp file that spills to disk past FORWARD_SPOOL_MEMORY_BYTES,
+    feeding the bytes to digest (a hashlib object) on the way"""
+    if attachment.size > FORWARD_MAX_BYTES:
+        return None
+    spool = tempfile.SpooledTemporaryFile(max_size=FORWARD_SPOOL_MEMORY_BYTES)
+    try:
+        async with get_http_session().get(attachment.url) as response:
+            response.raise_for_status()
+            received = 0
+            async for chunk in response.content.iter_chunked(FORWARD_CHUNK_BYTES):
+                received += len(chunk)
+                if received > FORWARD_MAX_BYTES:
+                    spool.close()
+                    return None
+                spool.write(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+async def open_forward_file(guild_id, attachment, digest=None):
+    """discord.File re-uploading a vouch image, or None when the guild forwards by URL or the copy failed"""
+    if get_guild_setting(guild_id, 'forward_mode') != 'spool':
+        return None
+    try:
+        spool = await spool_attachment(attachment, digest)
+    except Exception as e:
+        log.warning("Error downloading image %s: %s", attachment.filename, e)
+        return None
+    if spool is None:
+        log.info("Image %s is larger than %d bytes, forwarding by URL", attachment.filename, FORWARD_MAX_BYTES)
+        return None
+    try:
+        return discord.File(spool, filename=attachment.filename)
+    except TypeError:
+        # Before Python 3.11 SpooledTemporaryFile isn't an io.IOBase, which discord.File requires
+        spool.close()
+        log.warning("Can't re-upload spooled images on this Python version, forwarding %s by URL", attachment.filename)
+        return None
+
+def close_forward_file(file):
+    """discord.File doesn't own a file object it was given, so the spool behind it is closed too"""
+    file.close()
+    file.fp.close()
+
+# Duplicate image index
+duplicate_images = CounterMetric('vouchbot_duplicate_images_total', 'Vouch images seen before', ('match', 'action'))
+
+class ImageHashIndex:
+    """Keys of every vouch image already submitted, in a SQLite table keyed by the image key.
+    
+    Recently matched keys live in an LRU. Misses always go to the table (on a worker thread) and are
+    never cached, so a key another cluster worker indexed a moment ago is still found.
+    """
+    
+    def __init__(self, path, cache_size):
+        self.path = path
+        self.cache = LRUCache(cache_size)  # key: first record with that key
+        self.conn = None
+        self.lock = threading.Lock()
+    
+    def _connect(self):
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = connect_sqlite(self.path)
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS image_hashes '
+                '(k TEXT PRIMARY KEY, g TEXT NOT NULL, v TEXT NOT NULL, t INTEGER NOT NULL) WITHOUT ROWID'
+            )
+            self.conn = conn
+        return self.conn
+    
+    def _read(self, key):
+        with self.lock:
+            row = self._connect().execute('SELECT k, g, v, t FROM image_hashes WHERE k = ?', (key,)).fetchone()
+        return dict(zip('kgvt', row)) if row else None
+    
+    async def lookup(self, key):
+        """The record of the first vouch with this key, or None"""
+        record = self.cache.get(key)
+        if record is None:
+            record = await asyncio.to_thread(self._read, key)
+            if record is not None:
+                self.cache.put(key, record)
+        return record
+    
+    def _insert(self, records):
+        with self.lock:
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # OR IGNORE keeps the first vouch when two workers index the same image
+                conn.executemany(
+                    'INSERT OR IGNORE INTO image_hashes (k, g, v, t) VALUES (:k, :g, :v, :t)', records
+                )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+    
+    async def add(self, keys, guild_id, vouch_id):
+        records = [
+            {'k': key, 'g': guild_id, 'v': vouch_id, 't': int(time.time())}
+            for key in keys if self.cache.get(key) is None
+        ]
+        if records:
+            await asyncio.to_thread(self._insert, records)
+    
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+image_index = ImageHashIndex(os.path.join(DATA_DIR, 'image_hashes.db'), IMAGE_HASH_CACHE_SIZE)
+
+def image_metadata_key(attachment):
+    """Cheap key from what Discord tells us about an attachment, so most duplicates need no download"""
+    metadata = f"{attachment.size}:{attachment.filename.lower()}:{attachment.width}x{attachment.height}"
+    return hashlib.sha256(b'meta:' + metadata.encode()).hexdigest()
+
+def describe_duplicate(record, guild_id):
+    if record['g'] != guild_id:
+        return "This image was already submitted as a vouch in another server"
+    return f"This image was already submitted as vouch `{record['v']}` on <t:{record['t']}:f>"
+
+async def reject_duplicate(message):
+    embed = discord.Embed(
+        title="⚠️ Duplicate Image",
+        description="This image has already been submitted as a vouch. Please post your own, new screenshot!",
+        color=discord.Color.orange()
+    )
+    await message.channel.send(embed=embed, delete_after=10)
 
 # Button view for vouch approval
 class VouchApprovalView(ui.View):
     def __init__(self, vouch_id):
         super().__init__(timeout=None)  # No timeout - buttons stay active
         self.vouch_id = vouch_id
+        # custom_ids carry the vouch ID so the view can be re-registered after a restart
+        self.approve_button.custom_id = f"vouch:approve:{vouch_id}"
+        self.deny_button.custom_id = f"vouch:deny:{vouch_id}"
+    
+    async def interaction_check(self, interaction: discord.Interaction):
+        current_flow.set('approval')
+        return is_authorized(interaction.guild_id)
     
     @ui.button(label="✅ Approve", style=discord.ButtonStyle.green, emoji="✅")
     async def approve_button(self, interaction: discord.Interaction, button: ui.Button):
@@ -150,6 +1372,7 @@ class VouchApprovalView(ui.View):
         await self.handle_approval(interaction, approved=False)
     
     async def handle_approval(self, interaction: discord.Interaction, approved: bool):
+        clicked = time.perf_counter()
         # Check if user has admin permissions
         if not interaction.user.guild_permissions.administrator:
             await interaction.response.send_message(
@@ -158,23 +1381,26 @@ class VouchApprovalView(ui.View):
             )
             return
         
-        if self.vouch_id not in pending_vouches:
+        # Claim the vouch before any await so a second click can't process it again
+        vouch_data = remove_pending_vouch(self.vouch_id)
+        if vouch_data is None:
             await interaction.response.send_message(
                 "❌ This vouch has already been processed or doesn't exist!",
                 ephemeral=True
             )
             return
         
-        vouch_data = pending_vouches[self.vouch_id]
         guild_id = vouch_data['guild_id']
         user_id = vouch_data['user_id']
         original_channel_id = vouch_data['channel_id']
         original_message_id = vouch_data['message_id']
+        if 'timestamp' in vouch_data:
+            review_seconds.observe(time.time() - vouch_data['timestamp'], 'approved' if approved else 'denied')
         
         if approved:
             # Award the point
-            add_user_points(guild_id, user_id, 1)
-            current_points = get_user_points(guild_id, user_id)
+            _, current_points = await adjust_points(guild_id, user_id, 1)
+            approval_points_seconds.observe(time.perf_counter() - clicked)
             
             # Send approval message
             embed = discord.Embed(
@@ -208,7 +1434,7 @@ class VouchApprovalView(ui.View):
                     
                     await original_channel.send(embed=confirm_embed)
             except Exception as e:
-                print(f"Error sending approval confirmation: {e}")
+                log.warning("Error sending approval confirmation for vouch %s: %s", self.vouch_id, e)
         else:
             # Deny the vouch
             embed = discord.Embed(
@@ -241,10 +1467,7 @@ class VouchApprovalView(ui.View):
                     
                     await original_channel.send(embed=deny_embed)
             except Exception as e:
-                print(f"Error sending denial confirmation: {e}")
-        
-        # Remove from pending vouches
-        del pending_vouches[self.vouch_id]
+                log.warning("Error sending denial confirmation for vouch %s: %s", self.vouch_id, e)
 
 # Button view for reward redemption
 class RewardView(ui.View):
@@ -259,6 +1482,10 @@ class RewardView(ui.View):
             button = RewardButton(reward_name, reward_info['cost'], self.user_id, self.guild_id)
             self.add_item(button)
     
+    async def interaction_check(self, interaction: discord.Interaction):
+        current_flow.set('reward')
+        return is_authorized(interaction.guild_id)
+    
     async def on_timeout(self):
         # Disable all buttons when the view times out
         for item in self.children:
@@ -298,15 +1525,6 @@ class RewardButton(ui.Button):
         
         user_id = str(interaction.user.id)
         guild_id = str(interaction.guild.id)
-        user_points = get_user_points(guild_id, user_id)
-        
-        # Double check if user has enough points
-        if user_points < self.cost:
-            await interaction.response.send_message(
-                f"❌ You need {self.cost} points to redeem '{self.reward_name}' but you only have {user_points} points.",
-                ephemeral=True
-            )
-            return
         
         # Check if reward still exists in this guild
         guild_rewards = get_guild_rewards(guild_id)
@@ -317,8 +1535,14 @@ class RewardButton(ui.Button):
             )
             return
         
-        # Deduct points
-        set_user_points(guild_id, user_id, user_points - self.cost)
+        # Deduct points - refused atomically if the balance can't cover the cost
+        applied, remaining_points = await adjust_points(guild_id, user_id, -self.cost, min_balance=0)
+        if not applied:
+            await interaction.response.send_message(
+                f"❌ You need {self.cost} points to redeem '{self.reward_name}' but you only have {remaining_points} points.",
+                ephemeral=True
+            )
+            return
         
         # Send confirmation
         embed = discord.Embed(
@@ -326,7 +1550,6 @@ class RewardButton(ui.Button):
             description=f"**{interaction.user.mention}** successfully redeemed **{self.reward_name}**!",
             color=discord.Color.green()
         )
-        remaining_points = get_user_points(guild_id, user_id)
         embed.add_field(name="💰 Cost", value=f"{self.cost} points", inline=True)
         embed.add_field(name="💎 Remaining Points", value=f"{remaining_points} points", inline=True)
         embed.set_footer(text="Please contact an admin to claim your reward!")
@@ -349,11 +1572,7 @@ class RewardButton(ui.Button):
             pass  # User has DMs disabled
         
         # Send notification to admins
-        admin_channel = None
-        for channel in interaction.guild.channels:
-            if 'admin' in channel.name.lower() or 'staff' in channel.name.lower():
-                admin_channel = channel
-                break
+        admin_channel = get_admin_channel(interaction.guild)
         
         if admin_channel:
             admin_embed = discord.Embed(
@@ -368,190 +1587,809 @@ class RewardButton(ui.Button):
             
             await admin_channel.send(embed=admin_embed)
 
+# Storage maintenance task - batches ledger fsyncs and compacts in the background
+@tasks.loop(seconds=LEDGER_FSYNC_SECONDS)
+async def storage_maintenance():
+    try:
+        await storage.maintain()
+    except Exception:
+        log.exception("Error maintaining storage")
+
+# Member totals - kept current from guild and member events so the status never has to re-sum them
+guild_member_counts = {}  # guild_id: member count
+member_total = 0
+last_presence = {}  # shard_id (None when not sharded): (status text, monotonic time sent)
+
+def track_guild(guild):
+    global member_total
+    if not is_authorized(guild.id):
+        return
+    member_count = guild.member_count or 0
+    member_total += member_count - guild_member_counts.get(guild.id, 0)
+    guild_member_counts[guild.id] = member_count
+
+def untrack_guild(guild):
+    global member_total
+    member_total -= guild_member_counts.pop(guild.id, 0)
+
+def adjust_member_count(guild_id, delta):
+    global member_total
+    if guild_id in guild_member_counts:
+        guild_member_counts[guild_id] += delta
+        member_total += delta
+
+def reset_member_counts():
+    """Recount from the guild cache - only needed when a (re)connect replaces it"""
+    global member_total
+    guild_member_counts.clear()
+    member_total = 0
+    for guild in bot.guilds:
+        track_guild(guild)
+
+async def send_presence(status_text, shard_id=None):
+    """Change the presence only if its text changed and PRESENCE_MIN_SECONDS have passed"""
+    last_text, last_sent = last_presence.get(shard_id, (None, float('-inf')))  # monotonic() can be below PRESENCE_MIN_SECONDS right after boot
+    now = time.monotonic()
+    if status_text == last_text or now - last_sent < PRESENCE_MIN_SECONDS:
+        return
+    activity = discord.Activity(type=discord.ActivityType.watching, name=status_text)
+    if shard_id is None:
+        await bot.change_presence(activity=activity)
+    else:
+        await bot.change_presence(activity=activity, shard_id=shard_id)
+    last_presence[shard_id] = (status_text, now)
+
 # Bot status update task
 @tasks.loop(minutes=1)
 async def status_update():
     try:
-        total_guilds = len(bot.guilds)
-        total_users = sum(guild.member_count for guild in bot.guilds)
-        activity = discord.Activity(type=discord.ActivityType.watching, name=f"{total_guilds} servers | {total_users} users")
-        await bot.change_presence(activity=activity)
-    except Exception as e:
-        print(f"Error updating status: {str(e)}")
+        status_text = f"{len(guild_member_counts)} servers | {member_total} users"
+        if SHARDED:
+            # Each shard has its own presence, tag it so users can tell which shard serves them
+            for shard_id in bot.shards:
+                await send_presence(f"{status_text} | shard {shard_id}", shard_id)
+        else:
+            await send_presence(status_text)
+    except Exception:
+        log.exception("Error updating status")
 
-@bot.event
-async def on_ready():
-    print(f'{bot.user} has connected to Discord!')
-    print(f'Bot is in {len(bot.guilds)} guilds')
+def shard_stats():
+    """Per-shard guild count, member total and gateway latency"""
+    stats = {}  # shard_id: {'guilds', 'users', 'latency'}
     for guild in bot.guilds:
-        print(f'- {guild.name} (id: {guild.id})')
-    global points_data, rewards_data, vouch_roles_data, verification_channels
-    points_data = load_points()
+        shard = stats.setdefault(guild.shard_id, {'guilds': 0, 'users': 0, 'latency': None})
+        shard['guilds'] += 1
+        shard['users'] += guild.member_count or 0
+    if SHARDED:
+        for shard_id, latency in bot.latencies:
+            stats.setdefault(shard_id, {'guilds': 0, 'users': 0, 'latency': None})['latency'] = latency
+    else:
+        stats.setdefault(0, {'guilds': 0, 'users': 0, 'latency': None})['latency'] = bot.latency
+    return stats
+
+@status_update.before_loop
+async def before_status_update():
+    await bot.wait_until_ready()
+
+# Guild allowlist
+def is_authorized(guild_id):
+    return authorized_guilds is None or guild_id in authorized_guilds
+
+def load_authorized_servers():
+    """(Re)load the allowlist if its file changed. Returns True if it was reloaded"""
+    global authorized_guilds, authorized_servers_mtime
+    try:
+        mtime = os.stat(AUTHORIZED_SERVERS_FILE).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if mtime == authorized_servers_mtime:
+        return False
+    servers = read_json_file(AUTHORIZED_SERVERS_FILE if mtime is not None else None).get('servers') or []
+    authorized_guilds = frozenset(int(guild_id) for guild_id in servers) or None
+    authorized_servers_mtime = mtime
+    log.info("Guild allowlist loaded: %s", f"{len(authorized_guilds)} guild(s)" if authorized_guilds else "all guilds allowed")
+    return True
+
+async def leave_unauthorized_guilds():
+    for guild in list(bot.guilds):
+        if not is_authorized(guild.id):
+            log.warning("Leaving unauthorized guild %s (id: %s)", guild.name, guild.id)
+            await guild.leave()
+
+@tasks.loop(seconds=ALLOWLIST_RELOAD_SECONDS)
+async def allowlist_reload():
+    try:
+        if not load_authorized_servers() or not bot.is_ready():
+            return
+        reset_member_counts()
+        if AUTO_LEAVE_UNAUTHORIZED:
+            await leave_unauthorized_guilds()
+    except Exception:
+        log.exception("Error reloading the guild allowlist")
+
+# Slash command sync - skipped when the command payload hashes the same as the last sync
+def command_tree_hash(guild=None):
+    """Stable hash of the slash command payload for a guild (None for the global commands)"""
+    payload = sorted((command.to_dict() for command in bot.tree.get_commands(guild=guild)), key=lambda command: command['name'])
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+def load_command_sync_hashes():
+    return read_json_file(COMMAND_SYNC_FILE)
+
+def save_command_sync_hash(scope, tree_hash):
+    hashes = load_command_sync_hashes()
+    hashes[scope] = tree_hash
+    write_json_atomic(COMMAND_SYNC_FILE, hashes)
+
+async def sync_command_tree(guild=None, force=False):
+    """Sync slash commands globally or to one guild if they changed since the last sync there.
+    Returns the synced commands, or None if the sync was skipped"""
+    scope = 'global' if guild is None else str(guild.id)
+    if guild is not None:
+        bot.tree.copy_global_to(guild=guild)
+    tree_hash = command_tree_hash(guild)
+    if not force and tree_hash == (await asyncio.to_thread(load_command_sync_hashes)).get(scope):
+        log.info("Slash commands unchanged since the last sync (%s), skipping", scope)
+        return None
+    synced = await bot.tree.sync(guild=guild)
+    await asyncio.to_thread(save_command_sync_hash, scope, tree_hash)
+    return synced
+
+# ======= LOOP WATCHDOG =======
+loop_lag_seconds = HistogramMetric('vouchbot_loop_lag_seconds', 'How late the loop lag probe woke up')
+slow_handlers = CounterMetric('vouchbot_slow_handlers_total', 'Handlers that ran past SLOW_HANDLER_SECONDS', ('handler',))
+loop_stalls = CounterMetric('vouchbot_loop_stalls_total', 'Times the loop was blocked for SLOW_HANDLER_SECONDS')
+loop_lag_expected = None
+active_handlers = {}  # id: [handler name, perf_counter start, task, reported]
+handler_ids = itertools.count()
+profile_reports_written = 0
+stall_watchdog = None
+
+def write_profile_report(kind, name, body):
+    """Write a report to PROFILE_DIR, up to PROFILE_MAX_REPORTS per process"""
+    global profile_reports_written
+    if profile_reports_written >= PROFILE_MAX_REPORTS:
+        return
+    profile_reports_written += 1
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(PROFILE_DIR, f"{stamp}-{os.getpid()}-{profile_reports_written}-{kind}-{name}.txt")
+    write_text_atomic(path, body)
+    log.warning("Wrote %s report for %s to %s", kind, name, path)
+
+def describe_active_handlers(now):
+    try:
+        entries = list(active_handlers.values())
+    except RuntimeError:
+        return "(changed while reading)\n"  # Only happens if the loop moved on mid-copy
+    return ''.join(f"  {name}: running {now - started:.3f}s\n" for name, started, _, _ in entries) or "  (none)\n"
+
+@tasks.loop(seconds=LOOP_LAG_INTERVAL)
+async def loop_lag_monitor():
+    global loop_lag_expected
+    now = time.perf_counter()
+    if loop_lag_expected is not None:
+        lag = max(0.0, now - loop_lag_expected)
+        loop_lag_seconds.observe(lag)
+        if lag > LOOP_LAG_WARN_SECONDS:
+            log.warning("Event loop lagged %.3fs", lag)
+    loop_lag_expected = now + LOOP_LAG_INTERVAL
+    
+    # Handlers that are slow without blocking the loop - dump where they are waiting
+    if SLOW_HANDLER_SECONDS > 0:
+        for entry in list(active_handlers.values()):
+            name, started, task, reported = entry
+            if reported or now - started < SLOW_HANDLER_SECONDS:
+                continue
+            entry[3] = True
+            stack = ''.join(traceback.format_list(await_chain(task.get_coro()))) if task is not None else ''
+            body = f"{name} still running after {now - started:.3f}s (threshold {SLOW_HANDLER_SECONDS}s)\n\nAwaiting at:\n{stack}"
+            await asyncio.to_thread(write_profile_report, 'slow', name, body)
+
+def await_chain(coro):
+    """Where a suspended coroutine is waiting - one entry per coroutine it is awaiting through"""
+    summaries = []
+    while coro is not None:
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None)
+        if frame is None:
+            break
+        summaries.append(traceback.FrameSummary(frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name))
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+    return summaries
+
+def profile_handler(name, handler):
+    """Wrap a coroutine function so it is tracked while running and counted when slow"""
+    @functools.wraps(handler)
+    async def profiled(*args, **kwargs):
+        handler_id = next(handler_ids)
+        started = time.perf_counter()
+        active_handlers[handler_id] = [name, started, asyncio.current_task(), False]
+        try:
+            return await handler(*args, **kwargs)
+        finally:
+            del active_handlers[handler_id]
+            elapsed = time.perf_counter() - started
+            if elapsed >= SLOW_HANDLER_SECONDS:
+                slow_handlers.inc(name)
+                log.warning("%s took %.3fs", name, elapsed)
+    return profiled
+
+class StallWatchdog(threading.Thread):
+    """Pings the event loop from a thread and dumps the loop thread's stack when a ping goes unanswered"""
+    def __init__(self, loop, threshold):
+        super().__init__(name='stall-watchdog', daemon=True)
+        self.loop = loop
+        self.threshold = threshold
+        self.loop_thread_id = threading.get_ident()  # Created on the loop thread
+        self.answered = threading.Event()
+        self.stopping = threading.Event()
+    
+    def stop(self):
+        self.stopping.set()
+        self.answered.set()
+    
+    def run(self):
+        while not self.stopping.is_set():
+            self.answered.clear()
+            pinged = time.perf_counter()
+            self.loop.call_soon_threadsafe(self.answered.set)
+            if not self.answered.wait(self.threshold):
+                loop_stalls.inc()
+                frame = sys._current_frames().get(self.loop_thread_id)
+                stack = ''.join(traceback.format_stack(frame)) if frame is not None else "(loop thread not found)\n"
+                body = (f"Event loop blocked for over {self.threshold}s\n\nActive handlers:\n"
+                        f"{describe_active_handlers(time.perf_counter())}\nLoop thread stack:\n{stack}")
+                write_profile_report('stall', 'loop', body)
+                self.answered.wait()
+                log.warning("Event loop was blocked for %.3fs", time.perf_counter() - pinged)
+            self.stopping.wait(self.threshold / 2)
+
+def enable_handler_profiling():
+    """Wrap event handlers, prefix commands and view callbacks and start the stall watchdog"""
+    global stall_watchdog
+    for name, handler in list(vars(bot).items()):
+        if name.startswith('on_') and asyncio.iscoroutinefunction(handler):
+            setattr(bot, name, profile_handler(name, handler))
+    for command in bot.walk_commands():
+        command.callback = profile_handler(f"command:{command.qualified_name}", command.callback)
+    VouchApprovalView.handle_approval = profile_handler('VouchApprovalView.handle_approval', VouchApprovalView.handle_approval)
+    RewardButton.callback = profile_handler('RewardButton.callback', RewardButton.callback)
+    stall_watchdog = StallWatchdog(asyncio.get_running_loop(), SLOW_HANDLER_SECONDS)
+    stall_watchdog.start()
+    log.info("Handler profiling on - reports for anything over %ss go to %s", SLOW_HANDLER_SECONDS, PROFILE_DIR)
+
+# Metrics endpoint - gauges are computed when scraped, commands and REST calls are recorded as they happen
+GaugeMetric('vouchbot_pending_vouches', 'Vouches waiting for approval',
+            lambda: {(): sum(len(guild_pending) for guild_pending in pending_vouches.values())})
+GaugeMetric('vouchbot_intake_queued', 'Vouches accepted by intake and not finished', lambda: {(): vouch_intake.queued})
+GaugeMetric('vouchbot_intake_in_flight', 'Vouches being forwarded right now',
+            lambda: {(): sum(vouch_intake.in_flight.values())})
+GaugeMetric('vouchbot_guilds', 'Guilds per shard',
+            lambda: {(str(shard_id),): stats['guilds'] for shard_id, stats in shard_stats().items()}, ('shard',))
+GaugeMetric('vouchbot_gateway_latency_seconds', 'Gateway heartbeat latency per shard',
+            lambda: {(str(shard_id),): stats['latency'] for shard_id, stats in shard_stats().items()
+                     if stats['latency'] is not None and math.isfinite(stats['latency'])}, ('shard',))
+GaugeMetric('vouchbot_members', 'Members across authorized guilds', lambda: {(): member_total})
+metrics_runner = None
+
+@bot.before_invoke
+async def before_command(ctx):
+    ctx.metrics_started = time.perf_counter()
+    current_flow.set(f"command:{ctx.command.qualified_name}")
+
+@bot.after_invoke
+async def after_command(ctx):
+    command_seconds.observe(time.perf_counter() - ctx.metrics_started, 'prefix', ctx.command.qualified_name)
+
+def instrument_rest_calls():
+    """Count every Discord REST request against the flow that made it"""
+    request = bot.http.request
+    
+    async def counted_request(route, **kwargs):
+        rest_calls.inc(current_flow.get(), f"{route.method} {route.path}")
+        return await request(route, **kwargs)
+    
+    bot.http.request = counted_request
+
+async def metrics_handler(request):
+    return web.Response(text=render_metrics(), content_type='text/plain', charset='utf-8')
+
+async def start_metrics_server():
+    global metrics_runner
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    metrics_runner = web.AppRunner(app, access_log=None)
+    await metrics_runner.setup()
+    await web.TCPSite(metrics_runner, METRICS_HOST, METRICS_PORT).start()
+    log.info("Serving metrics on http://%s:%d/metrics", METRICS_HOST, METRICS_PORT)
+
+# One-time startup - runs before connecting, reconnects never reload state from disk
+@bot.event
+async def setup_hook():
+    global rewards_data, vouch_roles_data, verification_channels, guild_settings
+    load_authorized_servers()
+    instrument_rest_calls()
+    if METRICS_PORT:
+        await start_metrics_server()
+    storage.load()
     rewards_data = load_rewards()
     vouch_roles_data = load_vouch_roles()
     verification_channels = load_verification_channels()
+    guild_settings = load_guild_settings()
+    restored = restore_pending_vouches()
+    if restored:
+        log.info("Re-attached approval buttons for %d pending vouch(es)", restored)
+    storage_maintenance.start()
+    loop_lag_monitor.start()
+    if SLOW_HANDLER_SECONDS > 0:
+        enable_handler_profiling()
+    vouch_intake.start()
     status_update.start()
+    allowlist_reload.start()
+    # Shut down through bot.close() on SIGTERM too, so the ledger and queues are flushed
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.ensure_future(bot.close()))
+    except NotImplementedError:
+        pass  # Windows event loops have no signal handlers
     
-    # Sync slash commands
+    # Sync slash commands - in a cluster only the first worker does it, the commands are global
+    if CLUSTER_WORKER:
+        return
     try:
-        synced = await bot.tree.sync()
-        print(f"✅ Synced {len(synced)} slash command(s)")
-        if synced:
-            for cmd in synced:
-                print(f"   - /{cmd.name}")
-    except Exception as e:
-        print(f"❌ Failed to sync commands: {e}")
-        import traceback
-        traceback.print_exc()
+        guilds = [None] if DEV_GUILD_ID is None else [None, discord.Object(id=DEV_GUILD_ID)]
+        for guild in guilds:
+            synced = await sync_command_tree(guild)
+            if synced is not None:
+                log.info("Synced %d slash command(s) (%s): %s", len(synced), 'global' if guild is None else f'guild {guild.id}',
+                         ', '.join(f'/{cmd.name}' for cmd in synced))
+    except Exception:
+        log.exception("Failed to sync commands")
+
+# Release the HTTP session and flush storage when the bot shuts down
+close_bot = bot.close
+
+async def close():
+    await close_bot()
+    if stall_watchdog is not None:
+        stall_watchdog.stop()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+    if http_session is not None and not http_session.closed:
+        await http_session.close()
+    # Let a running maintenance pass finish so nothing touches storage after it is closed
+    task = storage_maintenance.get_task()
+    if task is not None and not task.done():
+        storage_maintenance.stop()
+        with contextlib.suppress(Exception):
+            await task
+    storage.close()
+    image_index.close()
+
+bot.close = close
+
+@bot.event
+async def on_ready():
+    # Fires again after every reconnect, so it only refreshes what the new guild cache replaced
+    log.info("%s has connected to Discord, in %d guilds", bot.user, len(bot.guilds))
+    startup_report = f"Ready {time.monotonic() - PROCESS_STARTED:.1f}s after start ({INTENTS_PROFILE} gateway profile)"
+    if resource is not None:
+        startup_report += f", peak memory {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB"
+    log.info(startup_report)
+    reset_member_counts()
+    if AUTO_LEAVE_UNAUTHORIZED:
+        await leave_unauthorized_guilds()
+    if log.isEnabledFor(logging.DEBUG):
+        for guild in bot.guilds:
+            log.debug("- %s (id: %s)", guild.name, guild.id)
 
 @bot.event
 async def on_disconnect():
-    print("Bot disconnected from Discord")
+    log.warning("Bot disconnected from Discord")
 
 @bot.event
 async def on_resumed():
-    print("Bot resumed connection to Discord")
+    log.info("Bot resumed connection to Discord")
 
 @bot.event
-async def on_error(event, *args, **kwargs):
-    print(f"An error occurred: {event}")
+async def on_shard_ready(shard_id):
+    log.info("Shard %s is ready", shard_id)
 
 @bot.event
-async def on_message(message):
+async def on_shard_disconnect(shard_id):
+    log.warning("Shard %s disconnected from Discord", shard_id)
+
+@bot.event
+async def on_shard_resumed(shard_id):
+    log.info("Shard %s resumed connection to Discord", shard_id)
+
+@bot.event
+async def on_error(event, *args, **kwargs):
+    log.exception("Unhandled error in %s", event)
+
+# Channel roles - which channels are vouch channels and where admin alerts go, per guild.
+# Built on first use and dropped whenever a channel in the guild is created, renamed or deleted.
+class GuildChannelIndex:
+    """Channel IDs a guild's handlers need, so the hot paths don't scan or lowercase channel names"""
+    __slots__ = ('vouch_channel_ids', 'thank_channel_id', 'admin_channel_id')
+    
+    def __init__(self, guild):
+        self.vouch_channel_ids = frozenset(c.id for c in guild.channels if 'vouch' in c.name.lower())
+        self.thank_channel_id = next((c.id for c in guild.text_channels if 'vouch' in c.name.lower()), None)
+        self.admin_channel_id = next(
+            (c.id for c in guild.text_channels if 'admin' in c.name.lower() or 'staff' in c.name.lower()),
+            None
+        )
+
+channel_indexes = {}  # guild_id: GuildChannelIndex
+
+def get_channel_index(guild):
+    index = channel_indexes.get(guild.id)
+    if index is None:
+        index = channel_indexes[guild.id] = GuildChannelIndex(guild)
+    return index
+
+def invalidate_channel_index(guild):
+    channel_indexes.pop(guild.id, None)
+
+def is_vouch_channel(channel):
+    """True if messages in this channel are vouches (channel name contains 'vouch')"""
+    if isinstance(channel, discord.Thread):
+        return 'vouch' in channel.name.lower()  # Threads aren't indexed
+    return channel.id in get_channel_index(channel.guild).vouch_channel_ids
+
+def get_vouch_channel(guild):
+    """The channel /thank points customers to"""
+    channel_id = get_channel_index(guild).thank_channel_id
+    return guild.get_channel(channel_id) if channel_id else None
+
+def get_admin_channel(guild):
+    """The channel that receives reward redemption alerts"""
+    channel_id = get_channel_index(guild).admin_channel_id
+    return guild.get_channel(channel_id) if channel_id else None
+
+class VouchRateLimiter:
+    """Token bucket per (guild, user). A bucket is forgotten once it would be full again, so memory
+    only holds users who vouched recently - and never more than max_entries of them"""
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.buckets = OrderedDict()  # (guild_id, user_id): (tokens, updated_at, full_at), least recently used first
+    
+    def try_acquire(self, guild_id, user_id, capacity, refill_seconds, now=None):
+        """Take one token. Returns (allowed, seconds until the next token)"""
+        if refill_seconds <= 0:
+            return True, 0
+        now = time.monotonic() if now is None else now
+        self.evict(now)
+        key = (str(guild_id), str(user_id))
+        tokens, updated_at, _ = self.buckets.pop(key, (capacity, now, now))
+        tokens = min(capacity, tokens + (now - updated_at) / refill_seconds)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        retry_after = 0 if tokens >= 1 else (1 - tokens) * refill_seconds
+        self.buckets[key] = (tokens, now, now + (capacity - tokens) * refill_seconds)
+        return allowed, retry_after
+    
+    def refund(self, guild_id, user_id, capacity, refill_seconds):
+        """Give back the token try_acquire took for a vouch that was refused afterwards"""
+        key = (str(guild_id), str(user_id))
+        if refill_seconds <= 0 or key not in self.buckets:
+            return
+        tokens, updated_at, _ = self.buckets[key]
+        tokens = min(capacity, tokens + 1)
+        self.buckets[key] = (tokens, updated_at, updated_at + (capacity - tokens) * refill_seconds)
+    
+    def evict(self, now):
+        while self.buckets:
+            key, (_, _, full_at) = next(iter(self.buckets.items()))
+            if full_at > now and len(self.buckets) < self.max_entries:
+                break
+            del self.buckets[key]
+    
+    def __len__(self):
+        return len(self.buckets)
+
+vouch_rate_limiter = VouchRateLimiter(RATE_LIMIT_MAX_ENTRIES)
+
+def find_vouch_image(message):
+    """First image attachment of a message, or None"""
+    for attachment in message.attachments:
+        if attachment.filename.lower().endswith(IMAGE_EXTENSIONS):
+            return attachment
+    return None
+
+class VouchIntake:
+    """Bounded priority queue of vouches drained by a fixed pool of workers.
+    
+    Smaller attachments are processed first. A guild that already has its limit of vouches in
+    flight gets its extra jobs parked, so one busy guild can't occupy every worker.
+    """
+    def __init__(self, workers, max_queued):
+        self.worker_count = workers
+        self.max_queued = max_queued
+        self.queue = None
+        self.queued = 0  # Accepted jobs not yet finished, including parked ones
+        self.in_flight = {}  # guild_id: jobs running
+        self.parked = {}  # guild_id: deque of jobs waiting for a guild slot
+        self.sequence = itertools.count()  # Keeps FIFO order between equal sizes
+        self.workers = []
+    
+    def start(self):
+        if self.workers:
+            return
+        self.queue = asyncio.PriorityQueue()
+        self.workers = [asyncio.create_task(self.worker()) for _ in range(self.worker_count)]
+    
+    def submit(self, guild_id, size, job):
+        """Queue job() for a worker. Returns False when the queue is full"""
+        if self.queue is None or self.queued >= self.max_queued:
+            return False
+        self.queued += 1
+        self.queue.put_nowait((size, next(self.sequence), guild_id, job))
+        return True
+    
+    async def worker(self):
+        while True:
+            entry = await self.queue.get()
+            size, _, guild_id, job = entry
+            limit = min(get_guild_setting(guild_id, 'intake_concurrency'), self.worker_count)
+            if self.in_flight.get(guild_id, 0) >= limit:
+                self.parked.setdefault(guild_id, deque()).append(entry)
+                continue
+            self.in_flight[guild_id] = self.in_flight.get(guild_id, 0) + 1
+            current_flow.set('intake')
+            try:
+                await job()
+            except Exception:
+                log.exception("Error in vouch intake worker (guild %s)", guild_id)
+            finally:
+                self.queued -= 1
+                self.in_flight[guild_id] -= 1
+                if not self.in_flight[guild_id]:
+                    del self.in_flight[guild_id]
+                parked = self.parked.get(guild_id)
+                if parked:
+                    self.queue.put_nowait(parked.popleft())
+                    if not parked:
+                        del self.parked[guild_id]
+
+vouch_intake = VouchIntake(INTAKE_WORKERS, INTAKE_QUEUE_SIZE)
+
+async def forward_vouch(message, verification_channel_id, current_time):
+    """Post a vouch to the verification channel with approve/deny buttons (runs on an intake worker)"""
+    user_id = str(message.author.id)
+    guild_id = str(message.guild.id)
+    
     try:
-        # Ignore bot messages
-        if message.author.bot:
-            await bot.process_commands(message)
+        verification_channel = bot.get_channel(int(verification_channel_id))
+        if not verification_channel:
+            log.warning("Verification channel %s not found (guild %s)", verification_channel_id, message.guild.id)
             return
         
-        user_id = str(message.author.id)
+        # Get image URL (the copy for re-uploading is streamed just before sending)
+        image_source = find_vouch_image(message)
+        image_url = image_source.url if image_source else None
+        
+        # Create unique vouch ID - the message ID, since one user can post several vouches within a second
+        vouch_id = f"{guild_id}_{user_id}_{message.id}"
+        
+        # Check the image against everything submitted before. Metadata (no download) is only a hint -
+        # different images can share it, so only a content hash match ever rejects
+        duplicate_mode = get_guild_setting(guild_id, 'duplicate_mode')
+        image_keys = []
+        metadata_match = None
+        if image_source is not None and duplicate_mode != 'off':
+            image_keys.append(image_metadata_key(image_source))
+            metadata_match = await image_index.lookup(image_keys[0])
+        
+        # Create embed for verification channel
+        verify_embed = discord.Embed(
+            title="🔍 Vouch Pending Approval",
+            description=f"New vouch submitted by **{message.author.mention}** ({message.author.display_name})",
+            color=discord.Color.blue()
+        )
+        verify_embed.add_field(name="User", value=f"<@{user_id}>", inline=True)
+        verify_embed.add_field(name="Channel", value=f"<#{message.channel.id}>", inline=True)
+        verify_embed.add_field(name="Original Message", value=f"[Jump to Message]({message.jump_url})", inline=False)
+        if image_url:
+            verify_embed.set_image(url=image_url)
+        verify_embed.set_footer(text=f"Vouch ID: {vouch_id}")
+        verify_embed.timestamp = message.created_at
+        
+        # Send to verification channel with approve/deny buttons and image attachment
+        # Spooled copies hold a forward slot from download until upload so disk/memory stay bounded
+        view = VouchApprovalView(vouch_id)
+        spooling = image_source is not None and get_guild_setting(guild_id, 'forward_mode') == 'spool'
+        async with (forward_slots if spooling else contextlib.nullcontext()):
+            # The spooled copy is hashed while it downloads, confirming metadata matches and catching
+            # duplicates renamed or resized by the client
+            digest = hashlib.sha256() if spooling and image_keys else None
+            image_attachment = await open_forward_file(guild_id, image_source, digest) if spooling else None
+            try:
+                if image_attachment is not None and digest is not None:
+                    image_keys.append(digest.hexdigest())
+                    duplicate_of = await image_index.lookup(image_keys[-1])
+                    if duplicate_of is not None:
+                        duplicate_images.inc('content', duplicate_mode)
+                        if duplicate_mode == 'reject':
+                            await reject_duplicate(message)
+                            return
+                else:
+                    # Nothing to confirm the metadata match with (forwarding by URL, or the copy failed) - flag it only
+                    duplicate_of = metadata_match
+                    if duplicate_of is not None:
+                        duplicate_images.inc('metadata', 'flag')
+                if duplicate_of is not None:
+                    verify_embed.color = discord.Color.orange()
+                    verify_embed.insert_field_at(0, name="⚠️ Possible Duplicate", value=describe_duplicate(duplicate_of, guild_id), inline=False)
+                # Store the pending vouch only now - nothing before the send can leave it behind
+                add_pending_vouch(vouch_id, {
+                    'guild_id': guild_id,
+                    'user_id': user_id,
+                    'message_id': str(message.id),
+                    'channel_id': str(message.channel.id),
+                    'image_url': image_url,
+                    'timestamp': current_time
+                })
+                try:
+                    if image_attachment:
+                        verification_message = await verification_channel.send(embed=verify_embed, view=view, file=image_attachment)
+                    else:
+                        verification_message = await verification_channel.send(embed=verify_embed, view=view)
+                except BaseException:
+                    remove_pending_vouch(vouch_id)  # Failed or cancelled - nothing for admins to click, don't keep it
+                    raise
+            finally:
+                if image_attachment is not None:
+                    close_forward_file(image_attachment)
+        intake_seconds.observe(time.time() - current_time)
+        if image_keys and duplicate_of is None:
+            await image_index.add(image_keys, guild_id, vouch_id)
+        
+        # Remember where the buttons live so they can be re-attached after a restart
+        vouch_data = get_pending_vouch(vouch_id)
+        if vouch_data is not None:
+            vouch_data['verification_message_id'] = str(verification_message.id)
+            save_pending_vouches(guild_id)
+        
+        # Send confirmation to original channel
+        confirm_embed = discord.Embed(
+            title="⏳ Vouch Submitted for Review",
+            description=f"Your vouch has been submitted for approval! An administrator will review it shortly.",
+            color=discord.Color.blue()
+        )
+        confirm_embed.add_field(name="Status", value="Pending Approval", inline=False)
+        confirm_embed.set_footer(text="You will be notified once your vouch is reviewed.")
+        
+        await message.channel.send(embed=confirm_embed, delete_after=15)
+        await message.add_reaction('⏳')
+        
+        log.info("Vouch sent to verification channel for %s in guild %s", message.author.id, message.guild.id)
+    except Exception:
+        log.exception("Error sending vouch to verification channel (guild %s)", message.guild.id)
+
+@bot.event
+async def on_guild_channel_create(channel):
+    invalidate_channel_index(channel.guild)
+
+@bot.event
+async def on_guild_channel_update(before, after):
+    if before.name != after.name or before.position != after.position:
+        invalidate_channel_index(after.guild)
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    invalidate_channel_index(channel.guild)
+
+@bot.event
+async def on_guild_join(guild):
+    if AUTO_LEAVE_UNAUTHORIZED and not is_authorized(guild.id):
+        log.warning("Leaving unauthorized guild %s (id: %s)", guild.name, guild.id)
+        await guild.leave()
+        return
+    track_guild(guild)
+
+@bot.event
+async def on_guild_remove(guild):
+    untrack_guild(guild)
+    invalidate_channel_index(guild)
+
+@bot.event
+async def on_member_join(member):
+    adjust_member_count(member.guild.id, 1)
+
+# The raw event - member_remove only fires for cached members, and the lean profile caches none
+@bot.event
+async def on_raw_member_remove(payload):
+    adjust_member_count(payload.guild_id, -1)
+
+@bot.event
+async def on_message(message):
+    # Fast path - most traffic is ordinary chat, decide that before allocating anything.
+    # Bots can't run commands and there are no DM features, so both are dropped outright,
+    # as is everything from guilds that aren't on the allowlist.
+    if message.author.bot or message.guild is None:
+        return
+    if authorized_guilds is not None and message.guild.id not in authorized_guilds:
+        return
+    if not is_vouch_channel(message.channel):
+        if message.content.startswith(COMMAND_PREFIX):
+            await bot.process_commands(message)
+        return
+    
+    # Vouch channel message (including emoji in the channel name)
+    try:
         guild_id = str(message.guild.id)
         
-        # Check if the message is in the vouch channel (including emoji)
-        if 'vouch' in message.channel.name.lower():
-            print("\n=== Vouch Channel Message ===")
-            
-            current_time = time.time()
+        current_flow.set('on_message')
+        current_time = time.time()
+        
+        # Check if the message has an image
+        image = None
+        for attachment in message.attachments:
+            if attachment.filename.lower().endswith(IMAGE_EXTENSIONS):
+                image = attachment
+                break
+        has_image = image is not None
+        log.debug("Vouch channel message in guild %s: %d attachment(s), image: %s", guild_id,
+                  len(message.attachments), has_image, extra={'sampled': True})
+        
+        # If image is present, send to verification channel for approval
+        if has_image:
+            # Get verification channel
+            verification_channel_id = get_verification_channel(guild_id)
             
-            # Check if the message has an image
-            has_image = False
-            for attachment in message.attachments:
-                print(f"Checking attachment: {attachment.filename}")
-                if any(attachment.filename.lower().endswith(ext) for ext in ['.png', '.jpg', '.jpeg', '.gif', '.webp']):
-                    has_image = True
-                    print(f"Found image: {attachment.filename}")
-                    break
+            if not verification_channel_id:
+                # No verification channel set, send error message
+                embed = discord.Embed(
+                    title="⚠️ Verification Channel Not Set",
+                    description="A verification channel needs to be set up for vouch approval. Please contact an administrator.",
+                    color=discord.Color.orange()
+                )
+                await message.channel.send(embed=embed, delete_after=10)
+                await bot.process_commands(message)
+                return
             
-            print(f"\nImage check result: {has_image}")
+            # Enforce the cooldown before any download or Discord call is spent on this vouch
+            burst = get_guild_setting(guild_id, 'vouch_burst')
+            refill_seconds = get_guild_setting(guild_id, 'cooldown_minutes') * 60
+            allowed, retry_after = vouch_rate_limiter.try_acquire(guild_id, message.author.id, burst, refill_seconds)
+            if not allowed:
+                embed = discord.Embed(
+                    title="⏳ Slow Down",
+                    description=f"You're vouching too fast! You can post another vouch in **{max(1, round(retry_after / 60))}** minute(s).",
+                    color=discord.Color.orange()
+                )
+                await message.channel.send(embed=embed, delete_after=10)
+                await bot.process_commands(message)
+                return
             
-            # If image is present, send to verification channel for approval
-            if has_image:
-                print("\n=== Vouch Detected - Sending for Approval ===")
-                
-                # Get verification channel
-                verification_channel_id = get_verification_channel(guild_id)
-                
-                if not verification_channel_id:
-                    # No verification channel set, send error message
-                    embed = discord.Embed(
-                        title="⚠️ Verification Channel Not Set",
-                        description="A verification channel needs to be set up for vouch approval. Please contact an administrator.",
-                        color=discord.Color.orange()
-                    )
-                    await message.channel.send(embed=embed, delete_after=10)
-                    await bot.process_commands(message)
-                    return
-                
-                try:
-                    verification_channel = bot.get_channel(int(verification_channel_id))
-                    if not verification_channel:
-                        print(f"Verification channel {verification_channel_id} not found!")
-                        await bot.process_commands(message)
-                        return
-                    
-                    # Get image URL and download image for attachment
-                    image_url = None
-                    image_attachment = None
-                    for attachment in message.attachments:
-                        if any(attachment.filename.lower().endswith(ext) for ext in ['.png', '.jpg', '.jpeg', '.gif', '.webp']):
-                            image_url = attachment.url
-                            # Download the image to send as attachment
-                            try:
-                                image_data = await attachment.read()
-                                image_attachment = discord.File(
-                                    io.BytesIO(image_data),
-                                    filename=attachment.filename
-                                )
-                            except Exception as e:
-                                print(f"Error downloading image: {e}")
-                            break
-                    
-                    # Create unique vouch ID
-                    vouch_id = f"{guild_id}_{user_id}_{int(current_time)}"
-                    
-                    # Store pending vouch
-                    pending_vouches[vouch_id] = {
-                        'guild_id': guild_id,
-                        'user_id': user_id,
-                        'message_id': str(message.id),
-                        'channel_id': str(message.channel.id),
-                        'image_url': image_url,
-                        'timestamp': current_time
-                    }
-                    
-                    # Create embed for verification channel
-                    verify_embed = discord.Embed(
-                        title="🔍 Vouch Pending Approval",
-                        description=f"New vouch submitted by **{message.author.mention}** ({message.author.display_name})",
-                        color=discord.Color.blue()
-                    )
-                    verify_embed.add_field(name="User", value=f"<@{user_id}>", inline=True)
-                    verify_embed.add_field(name="Channel", value=f"<#{message.channel.id}>", inline=True)
-                    verify_embed.add_field(name="Original Message", value=f"[Jump to Message]({message.jump_url})", inline=False)
-                    if image_url:
-                        verify_embed.set_image(url=image_url)
-                    verify_embed.set_footer(text=f"Vouch ID: {vouch_id}")
-                    verify_embed.timestamp = message.created_at
-                    
-                    # Send to verification channel with approve/deny buttons and image attachment
-                    view = VouchApprovalView(vouch_id)
-                    if image_attachment:
-                        await verification_channel.send(embed=verify_embed, view=view, file=image_attachment)
-                    else:
-                        await verification_channel.send(embed=verify_embed, view=view)
-                    
-                    # Send confirmation to original channel
-                    confirm_embed = discord.Embed(
-                        title="⏳ Vouch Submitted for Review",
-                        description=f"Your vouch has been submitted for approval! An administrator will review it shortly.",
-                        color=discord.Color.blue()
-                    )
-                    confirm_embed.add_field(name="Status", value="Pending Approval", inline=False)
-                    confirm_embed.set_footer(text="You will be notified once your vouch is reviewed.")
-                    
-                    await message.channel.send(embed=confirm_embed, delete_after=15)
-                    await message.add_reaction('⏳')
-                    
-                    print(f"Vouch sent to verification channel for {message.author.name} in {message.guild.name}")
-                except Exception as e:
-                    print(f"Error sending vouch to verification channel: {str(e)}")
-            else:
-                print("\n=== Conditions Not Met ===")
-                print(f"- Has image: {has_image}")
-                if not has_image:
-                    # Send helpful message if no image
-                    embed = discord.Embed(
-                        title="⚠️ Image Required",
-                        description="Please include an image attachment with your vouch!",
-                        color=discord.Color.orange()
-                    )
-                    embed.set_footer(text="Supported formats: PNG, JPG, JPEG, GIF, WEBP")
-                    await message.channel.send(embed=embed, delete_after=10)
+            # Hand the download and Discord calls to the intake workers, refusing when the queue is full
+            job = functools.partial(forward_vouch, message, verification_channel_id, current_time)
+            if not vouch_intake.submit(guild_id, image.size, job):
+                # Refused, so it doesn't count against the cooldown
+                vouch_rate_limiter.refund(guild_id, message.author.id, burst, refill_seconds)
+                busy_embed = discord.Embed(
+                    title="⏳ Vouch Queue Full",
+                    description="Lots of vouches are being submitted right now. Please post yours again in a few minutes.",
+                    color=discord.Color.orange()
+                )
+                await message.channel.send(embed=busy_embed, delete_after=10)
+        else:
+            if not has_image:
+                # Send helpful message if no image
+                embed = discord.Embed(
+                    title="⚠️ Image Required",
+                    description="Please include an image attachment with your vouch!",
+                    color=discord.Color.orange()
+                )
+                embed.set_footer(text="Supported formats: PNG, JPG, JPEG, GIF, WEBP")
+                await message.channel.send(embed=embed, delete_after=10)
         
         # Process commands
         await bot.process_commands(message)
-    except Exception as e:
-        print(f"Error processing message: {str(e)}")
+    except Exception:
+        log.exception("Error processing message in guild %s", message.guild.id)
 
 # ======= VOUCH ROLE MANAGEMENT COMMANDS =======
 @bot.command(name='addvouchrole')
@@ -568,7 +2406,7 @@ async def add_vouch_role(ctx, role_name: str):
     existing_roles_lower = [r.lower() for r in vouch_roles_data[guild_id]]
     if role_name.lower() not in existing_roles_lower:
         vouch_roles_data[guild_id].append(role_name)
-        save_vouch_roles()
+        save_vouch_roles(guild_id)
         
         embed = discord.Embed(
             title="✅ Vouch Role Added",
@@ -610,7 +2448,7 @@ async def remove_vouch_role(ctx, role_name: str):
         if not vouch_roles_data[guild_id]:
             vouch_roles_data[guild_id] = ["CHEF"]
         
-        save_vouch_roles()
+        save_vouch_roles(guild_id)
         
         embed = discord.Embed(
             title="✅ Vouch Role Removed",
@@ -687,6 +2525,93 @@ async def set_verify_channel(ctx, channel: discord.TextChannel = None):
     embed.set_footer(text="All vouches will now be sent here for approval")
     await ctx.send(embed=embed)
 
+@bot.command(name='setforwardmode')
+@commands.has_permissions(administrator=True)
+async def set_forward_mode(ctx, mode: str):
+    """Choose how vouch images reach the verification channel: spool or url (Admin only)"""
+    mode = mode.lower()
+    if mode not in FORWARD_MODES:
+        await ctx.send(f"Please choose one of: {', '.join(FORWARD_MODES)}")
+        return
+    
+    set_guild_setting(ctx.guild.id, 'forward_mode', mode)
+    
+    embed = discord.Embed(
+        title="✅ Forward Mode Set",
+        description=f"Vouch images will now be forwarded using `{mode}` mode",
+        color=discord.Color.green()
+    )
+    if mode == 'url':
+        embed.add_field(name="How it works", value="The verification post links the original image - nothing is downloaded or re-uploaded", inline=False)
+    else:
+        embed.add_field(name="How it works", value="A copy of the image is re-uploaded to the verification channel", inline=False)
+    embed.add_field(name="Server", value=ctx.guild.name, inline=False)
+    await ctx.send(embed=embed)
+
+@bot.command(name='setintakelimit')
+@commands.has_permissions(administrator=True)
+async def set_intake_limit(ctx, limit: int):
+    """Set how many vouches from this server are forwarded at the same time (Admin only)"""
+    if limit < 1 or limit > INTAKE_WORKERS:
+        await ctx.send(f"Please choose a limit between 1 and {INTAKE_WORKERS}.")
+        return
+    
+    set_guild_setting(ctx.guild.id, 'intake_concurrency', limit)
+    
+    embed = discord.Embed(
+        title="✅ Intake Limit Set",
+        description=f"Up to **{limit}** vouches from this server will be processed at the same time",
+        color=discord.Color.green()
+    )
+    embed.add_field(name="Server", value=ctx.guild.name, inline=False)
+    await ctx.send(embed=embed)
+
+@bot.command(name='setcooldown')
+@commands.has_permissions(administrator=True)
+async def set_cooldown(ctx, minutes: float, burst: int = None):
+    """Set the vouch cooldown in minutes (0 disables) and optionally how many vouches a user can post back to back (Admin only)"""
+    if minutes < 0 or (burst is not None and burst < 1):
+        await ctx.send("Please provide a cooldown of 0 or more minutes and a burst of at least 1.")
+        return
+    
+    set_guild_setting(ctx.guild.id, 'cooldown_minutes', minutes)
+    if burst is None:
+        burst = get_guild_setting(ctx.guild.id, 'vouch_burst')  # Keep the current burst
+    else:
+        set_guild_setting(ctx.guild.id, 'vouch_burst', burst)
+    
+    embed = discord.Embed(
+        title="✅ Vouch Cooldown Set",
+        description="Vouch cooldown disabled for this server" if minutes == 0 else f"Users can post **{burst}** vouch(es), then one more every **{minutes:g}** minute(s)",
+        color=discord.Color.green()
+    )
+    embed.add_field(name="Server", value=ctx.guild.name, inline=False)
+    await ctx.send(embed=embed)
+
+@bot.command(name='setduplicatemode')
+@commands.has_permissions(administrator=True)
+async def set_duplicate_mode(ctx, mode: str):
+    """Choose what happens to vouch images that were submitted before: off, flag or reject (Admin only)"""
+    mode = mode.lower()
+    if mode not in DUPLICATE_MODES:
+        await ctx.send(f"Please choose one of: {', '.join(DUPLICATE_MODES)}")
+        return
+    
+    set_guild_setting(ctx.guild.id, 'duplicate_mode', mode)
+    
+    descriptions = {
+        'off': "Vouch images are no longer checked for duplicates",
+        'flag': "Duplicate vouch images are marked for reviewers in the verification channel",
+        'reject': "Vouch images whose content matches an earlier one are refused; likely duplicates that can't be confirmed are marked for reviewers",
+    }
+    embed = discord.Embed(
+        title="✅ Duplicate Mode Set",
+        description=descriptions[mode],
+        color=discord.Color.green()
+    )
+    embed.add_field(name="Server", value=ctx.guild.name, inline=False)
+    await ctx.send(embed=embed)
+
 @bot.command(name='getverifychannel')
 async def get_verify_channel(ctx):
     """Get the current verification channel"""
@@ -729,13 +2654,44 @@ async def get_verify_channel(ctx):
     
     await ctx.send(embed=embed)
 
+@bot.command(name='shards')
+@commands.has_permissions(administrator=True)
+async def show_shards(ctx):
+    """Show guilds, users and latency for each shard in this process (Admin only)"""
+    embed = discord.Embed(
+        title="🛰️ Shard Status",
+        description=f"This server is on shard **{ctx.guild.shard_id}**",
+        color=discord.Color.blue()
+    )
+    for shard_id, shard in sorted(shard_stats().items()):
+        latency = f"{shard['latency'] * 1000:.0f} ms" if shard['latency'] is not None else "n/a"
+        embed.add_field(
+            name=f"Shard {shard_id}",
+            value=f"{shard['guilds']} servers\n{shard['users']} users\n{latency}",
+            inline=True
+        )
+    embed.set_footer(text=f"Shard count: {bot.shard_count or 1}")
+    await ctx.send(embed=embed)
+
 # ======= SLASH COMMANDS =======
 @bot.command(name='sync')
 @commands.has_permissions(administrator=True)
-async def sync_commands(ctx):
+async def sync_commands(ctx, *options: str):
     """Manually sync slash commands (Admin only)"""
+    # `!sync` syncs globally if the commands changed, `!sync guild` syncs to this server only
+    # (shows up instantly), `force` syncs even if nothing changed
+    options = {option.lower() for option in options}
+    guild = ctx.guild if 'guild' in options else None
     try:
-        synced = await bot.tree.sync()
+        synced = await sync_command_tree(guild, force='force' in options)
+        if synced is None:
+            embed = discord.Embed(
+                title="✅ Already Up To Date",
+                description="Slash commands haven't changed since the last sync. Use `!sync force` to sync anyway.",
+                color=discord.Color.green()
+            )
+            await ctx.send(embed=embed)
+            return
         embed = discord.Embed(
             title="✅ Commands Synced",
             description=f"Successfully synced {len(synced)} slash command(s)",
@@ -754,17 +2710,26 @@ async def sync_commands(ctx):
         )
         await ctx.send(embed=embed)
 
+# Slash commands from guilds that aren't on the allowlist are dropped before they run
+async def tree_interaction_check(interaction: discord.Interaction):
+    interaction.extras['started'] = time.perf_counter()
+    current_flow.set(f"slash:{interaction.command.name}" if interaction.command else 'slash')
+    return is_authorized(interaction.guild_id)
+
+bot.tree.interaction_check = tree_interaction_check
+
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    if 'started' in interaction.extras:
+        command_seconds.observe(time.perf_counter() - interaction.extras['started'], 'slash', command.qualified_name)
+
 @bot.tree.command(name="thank", description="Thank a customer and guide them to the vouch channel")
 @app_commands.describe(member="The customer to thank")
 async def thank_command(interaction: discord.Interaction, member: discord.Member):
     """Thank a customer for choosing the server and guide them to vouch"""
     
     # Find vouch channel
-    vouch_channel = None
-    for channel in interaction.guild.text_channels:
-        if 'vouch' in channel.name.lower():
-            vouch_channel = channel
-            break
+    vouch_channel = get_vouch_channel(interaction.guild)
     
     embed = discord.Embed(
         title="🙏 Thank You!",
@@ -798,6 +2763,8 @@ async def check_points(ctx, member: discord.Member = None):
         member = ctx.author
     
     points = get_user_points(ctx.guild.id, member.id)
+    ranking = await get_guild_ranking(ctx.guild.id)
+    rank = ranking.rank(str(member.id))
     
     embed = discord.Embed(
         title="💎 Points System",
@@ -805,6 +2772,8 @@ async def check_points(ctx, member: discord.Member = None):
         color=discord.Color.blue()
     )
     embed.add_field(name="Points", value=f"**{points}** points", inline=False)
+    if rank is not None:
+        embed.add_field(name="Rank", value=f"**#{rank}** of {len(ranking)}", inline=False)
     embed.add_field(name="Server", value=ctx.guild.name, inline=False)
     await ctx.send(embed=embed)
 
@@ -816,8 +2785,7 @@ async def add_points_cmd(ctx, member: discord.Member, amount: int):
         await ctx.send("Please provide a positive number of points.")
         return
     
-    add_user_points(ctx.guild.id, member.id, amount)
-    new_total = get_user_points(ctx.guild.id, member.id)
+    _, new_total = await adjust_points(ctx.guild.id, member.id, amount)
     
     embed = discord.Embed(
         title="✅ Points Added",
@@ -836,9 +2804,7 @@ async def remove_points_cmd(ctx, member: discord.Member, amount: int):
         await ctx.send("Please provide a positive number of points.")
         return
     
-    current_points = get_user_points(ctx.guild.id, member.id)
-    new_points = max(0, current_points - amount)
-    set_user_points(ctx.guild.id, member.id, new_points)
+    _, new_points = await adjust_points(ctx.guild.id, member.id, -amount, min_balance=0, clamp=True)
     
     embed = discord.Embed(
         title="❌ Points Removed",
@@ -850,10 +2816,13 @@ async def remove_points_cmd(ctx, member: discord.Member, amount: int):
     await ctx.send(embed=embed)
 
 @bot.command(name='leaderboard')
-async def show_leaderboard(ctx):
-    """Show the top 10 users with the most points in this server"""
-    guild_points = get_guild_points(ctx.guild.id)
-    sorted_users = sorted(guild_points.items(), key=lambda x: x[1], reverse=True)[:10]
+async def show_leaderboard(ctx, page: int = 1):
+    """Show the users with the most points in this server, 10 per page"""
+    ranking = await get_guild_ranking(ctx.guild.id)
+    total_pages = max(1, -(-len(ranking) // LEADERBOARD_PAGE_SIZE))
+    page = min(max(1, page), total_pages)
+    start = (page - 1) * LEADERBOARD_PAGE_SIZE
+    sorted_users = ranking.page(start, LEADERBOARD_PAGE_SIZE)
     
     embed = discord.Embed(
         title="🏆 Points Leaderboard",
@@ -864,20 +2833,15 @@ async def show_leaderboard(ctx):
     if not sorted_users:
         embed.add_field(name="No Data", value="No points have been awarded in this server yet!", inline=False)
     else:
-        for i, (user_id, points) in enumerate(sorted_users, 1):
-            try:
-                user = await bot.fetch_user(int(user_id))
-                embed.add_field(
-                    name=f"{i}. {user.display_name}",
-                    value=f"**{points}** points",
-                    inline=False
-                )
-            except:
-                embed.add_field(
-                    name=f"{i}. Unknown User",
-                    value=f"**{points}** points",
-                    inline=False
-                )
+        names = await resolve_display_names(ctx.guild, [user_id for user_id, _ in sorted_users])
+        for i, (user_id, points) in enumerate(sorted_users, start + 1):
+            embed.add_field(
+                name=f"{i}. {names.get(user_id, 'Unknown User')}",
+                value=f"**{points}** points",
+                inline=False
+            )
+        if total_pages > 1:
+            embed.set_footer(text=f"Page {page}/{total_pages} - use !leaderboard <page> to see more")
     
     await ctx.send(embed=embed)
 
@@ -896,7 +2860,7 @@ async def add_reward(ctx, name: str, cost: int):
         'cost': cost,
         'name': name
     }
-    save_rewards()
+    save_rewards(guild_id)
     
     embed = discord.Embed(
         title="✅ Reward Added",
@@ -918,7 +2882,7 @@ async def remove_reward(ctx, name: str):
         return
     
     del guild_rewards[name]
-    save_rewards()
+    save_rewards(guild_id)
     
     embed = discord.Embed(
         title="❌ Reward Removed",
@@ -1009,7 +2973,6 @@ async def redeem_reward(ctx, *, reward_name: str):
     user_id = str(ctx.author.id)
     guild_id = str(ctx.guild.id)
     guild_rewards = get_guild_rewards(guild_id)
-    user_points = get_user_points(guild_id, user_id)
     
     if reward_name not in guild_rewards:
         await ctx.send(f"Reward '{reward_name}' not found in this server. Use `!rewards` to see available rewards.")
@@ -1017,20 +2980,18 @@ async def redeem_reward(ctx, *, reward_name: str):
     
     reward_cost = guild_rewards[reward_name]['cost']
     
-    if user_points < reward_cost:
+    # Deduct points - refused atomically if the balance can't cover the cost
+    applied, remaining_points = await adjust_points(guild_id, user_id, -reward_cost, min_balance=0)
+    if not applied:
         embed = discord.Embed(
             title="❌ Insufficient Points",
-            description=f"You need {reward_cost} points to redeem '{reward_name}' but you only have {user_points} points.",
+            description=f"You need {reward_cost} points to redeem '{reward_name}' but you only have {remaining_points} points.",
             color=discord.Color.red()
         )
         await ctx.send(embed=embed)
         return
     
-    # Deduct points
-    set_user_points(guild_id, user_id, user_points - reward_cost)
-    
     # Send confirmation to user
-    remaining_points = get_user_points(guild_id, user_id)
     embed = discord.Embed(
         title="🎁 Reward Redeemed! 🎁",
         description=f"**{ctx.author.mention}** successfully redeemed **{reward_name}**!",
@@ -1058,11 +3019,7 @@ async def redeem_reward(ctx, *, reward_name: str):
         pass  # User has DMs disabled
     
     # Send notification to admins
-    admin_channel = None
-    for channel in ctx.guild.channels:
-        if 'admin' in channel.name.lower() or 'staff' in channel.name.lower():
-            admin_channel = channel
-            break
+    admin_channel = get_admin_channel(ctx.guild)
     
     if admin_channel:
         admin_embed = discord.Embed(
@@ -1091,7 +3048,7 @@ async def show_commands(ctx):
     # Points Commands
     embed.add_field(
         name="📊 Points Commands",
-        value="`!points [user]` - Check points\n`!leaderboard` - Show top users\n`!addpoints <user> <amount>` - Add points (Admin)\n`!removepoints <user> <amount>` - Remove points (Admin)",
+        value="`!points [user]` - Check points\n`!leaderboard [page]` - Show top users\n`!addpoints <user> <amount>` - Add points (Admin)\n`!removepoints <user> <amount>` - Remove points (Admin)",
         inline=False
     )
     
@@ -1105,7 +3062,7 @@ async def show_commands(ctx):
     # Verification Commands
     embed.add_field(
         name="🔍 Verification Commands",
-        value="`!setverifychannel [#channel]` - Set verification channel (Admin)\n`!getverifychannel` - Get current verification channel",
+        value="`!setverifychannel [#channel]` - Set verification channel (Admin)\n`!getverifychannel` - Get current verification channel\n`!setforwardmode <spool|url>` - How vouch images are forwarded (Admin)\n`!setintakelimit <n>` - Vouches processed at once (Admin)\n`!setcooldown <minutes> [burst]` - Vouch cooldown (Admin)\n`!setduplicatemode <off|flag|reject>` - Duplicate vouch images (Admin)\n`!sync [guild] [force]` - Sync slash commands (Admin)\n`!shards` - Shard status and latency (Admin)",
         inline=False
     )
     
@@ -1127,5 +3084,89 @@ async def show_commands(ctx):
     embed.set_footer(text="Each server has independent points, roles, and rewards!")
     await ctx.send(embed=embed)
 
+# ======= CLUSTER LAUNCHER =======
+def cluster_shard_ranges(process_count, shard_count):
+    """Split shards 0..shard_count-1 into process_count contiguous (first, last) ranges"""
+    base, extra = divmod(shard_count, process_count)
+    ranges = []
+    first = 0
+    for index in range(process_count):
+        size = base + (1 if index < extra else 0)
+        ranges.append((first, first + size - 1))
+        first += size
+    return ranges
+
+def run_cluster():
+    """Run one bot process per shard range on this machine and restart any that crash"""
+    shard_count = SHARD_COUNT or CLUSTER_PROCESSES
+    if shard_count < CLUSTER_PROCESSES:
+        raise SystemExit("SHARD_COUNT must be at least CLUSTER_PROCESSES")
+    if STORAGE_BACKEND != 'sqlite':
+        log.info("Cluster mode shares state through SQLite - using STORAGE_BACKEND=sqlite for the workers")
+    
+    ranges = cluster_shard_ranges(CLUSTER_PROCESSES, shard_count)
+    workers = {}  # index: subprocess.Popen
+    started_at = {}  # index: monotonic start time
+    restart_at = {}  # index: monotonic time a crashed worker is due to be restarted
+    restarts = {}  # index: consecutive quick restarts, for the backoff
+    stopping = False
+    
+    def spawn(index):
+        first, last = ranges[index]
+        env = dict(
+            os.environ,
+            CLUSTER_WORKER=str(index),
+            SHARD_COUNT=str(shard_count),
+            SHARD_IDS=f"{first}-{last}",
+            STORAGE_BACKEND='sqlite',
+        )
+        log.info("Starting cluster worker %d for shards %d-%d", index, first, last)
+        workers[index] = subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+        started_at[index] = time.monotonic()
+    
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for worker in workers.values():
+            if worker.poll() is None:
+                worker.terminate()
+    
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(len(ranges)):
+        spawn(index)
+    
+    while not stopping:
+        time.sleep(1)
+        now = time.monotonic()
+        for index, worker in workers.items():
+            if stopping or index in restart_at or worker.poll() is None:
+                continue
+            # A worker that ran for a while gets its backoff reset
+            if now - started_at[index] > CLUSTER_RESTART_MAX_SECONDS:
+                restarts[index] = 0
+            delay = min(CLUSTER_RESTART_MAX_SECONDS, 2 ** restarts.get(index, 0))
+            restarts[index] = restarts.get(index, 0) + 1
+            restart_at[index] = now + delay
+            log.warning("Cluster worker %d exited with code %s, restarting in %ss", index, worker.returncode, delay)
+        for index, due in list(restart_at.items()):
+            if not stopping and due <= now:
+                del restart_at[index]
+                spawn(index)
+    
+    # Workers close the bot on SIGTERM; one that hangs past the deadline is killed
+    deadline = time.monotonic() + CLUSTER_STOP_TIMEOUT_SECONDS
+    for index, worker in workers.items():
+        try:
+            worker.wait(max(0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            log.warning("Cluster worker %d did not stop within %ss, killing it", index, CLUSTER_STOP_TIMEOUT_SECONDS)
+            worker.kill()
+            worker.wait()
+
 # Run the bot
-bot.run(TOKEN, reconnect=True) 
+if __name__ == '__main__':
+    if CLUSTER_PROCESSES > 1 and CLUSTER_WORKER is None:
+        run_cluster()
+    else:
+        bot.run(TOKEN, reconnect=True, log_handler=None)  # discord.py logs through our queue handler